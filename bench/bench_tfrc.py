@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Distributed under the terms of the GNU Public License (GPLv3)
+"""
+Measure how the tfrc driver scales with the number of sensors and the size
+of the sensor map.
+
+The driver is run against the tfrec stand-in in this directory, which emits
+synthetic 'tfrec -D' output for the requested number of sensors of each
+enabled type.  For every combination of sensor count and sensor_map size this
+reports:
+
+  lines, packets      - lines and packets per second through genLoopPackets
+  read                - CPU per line in the rest of the process: the reader
+                        threads, splitting lines and the loop itself
+  parse               - CPU per line in PacketFactory
+  dedup               - CPU per line in the duplicate filter
+  reception           - CPU per line in the loss and rssi accounting
+  map                 - CPU per line in map_to_fields
+  deltas              - CPU per line in the delta calculation
+  lat_*               - mean, 95th percentile and maximum delay in ms between
+                        the time a telegram was due and the time its packet
+                        left genLoopPackets
+
+The stage timings are those of the driver itself (see stats_file): the CPU
+time of the driver thread in each stage, which includes the cost of timing.
+The read column is the CPU time of the whole process less the stages.  All
+are in microseconds per line, and need python 3.7 or later for the CPU time
+of a thread.  Latency is only meaningful when a rate is specified; with
+--rate=0 the stand-in emits as fast as it can.
+The handler records have no telegram counter, so there is no latency with
+--ingest=handler.
+
+Example:
+
+  python3 bench/bench_tfrc.py --sensors=1,10,50 --map-sizes=10,40,160
+"""
+from __future__ import print_function
+import optparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'bin', 'user'))
+
+import tfrc
+
+
+def sensor_map(size, sensors):
+    # map the temperature of each simulated TFA_1 sensor, then pad the map
+    # with elements for sensors that do not exist and with glob elements.
+    smap = dict()
+    for i in range(size):
+        if i % 4 == 3:
+            smap['glob%d' % i] = 'humidity.%X*.TFA_1Packet' % (i % 16)
+        else:
+            smap['temp%d' % i] = 'temperature.%04X.TFA_1Packet' % (0x1000 + i)
+    return smap
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+STAGES = ['parse', 'dedup', 'reception', 'map', 'deltas']
+
+
+def run(options, sensors, map_size):
+    # run genLoopPackets with stats enabled, and take the stage timings from
+    # the driver.  the lines are tapped on their way into the driver to find
+    # the telegram that produced each packet.
+    cmd = 'tfrec -D -T %s --sensors %d --rate %s --count %d' % (
+        options.types, sensors, options.rate, options.count)
+    stats_file = os.path.join(BENCH_DIR, '.bench-stats.json')
+    driver = tfrc.TFRCDriver(cmd=cmd, path=BENCH_DIR, reader=options.reader,
+                             ingest=options.ingest, max_restarts=0,
+                             sensor_map=sensor_map(map_size, sensors),
+                             idle_timeout=0, stats_file=stats_file,
+                             stats_interval=0, loss_fields=True)
+    mgr = driver.manager
+    get_lines = mgr.get_lines
+    state = dict(line=None, start=None)
+
+    def tap(timeout=None):
+        for line in get_lines(timeout):
+            if state['start'] is None:
+                for err in mgr.get_stderr():
+                    if err.startswith('start '):
+                        state['start'] = float(err.split()[1])
+            state['line'] = line
+            yield line
+
+    mgr.get_lines = tap
+    latencies = []
+    cpu0 = time.process_time()
+    t0 = time.time()
+    try:
+        for _ in driver.genLoopPackets():
+            if (state['start'] is not None and options.rate and
+                state['line'].startswith('#')):
+                n = int(state['line'].split(None, 1)[0][1:])
+                latencies.append(
+                    time.time() - (state['start'] + n / options.rate))
+    except tfrc.weewx.WeeWxIOError:
+        pass # the stand-in exits after count telegrams
+    elapsed = time.time() - t0
+    cpu = time.process_time() - cpu0
+    driver.closePort()
+    counters = driver.stats.counters
+    timings = driver.stats.timings
+    n = float(max(counters.get('lines_read', 0), 1))
+    r = dict(lines=counters.get('lines_read', 0) / elapsed,
+             packets=counters.get('packets', 0) / elapsed)
+    for stage in STAGES:
+        r[stage] = timings.get(stage, 0.0) / n * 1e6
+    r['read'] = (cpu - sum(timings.values())) / n * 1e6
+    r['lat_mean'] = sum(latencies) / len(latencies) * 1e3 if latencies else 0
+    r['lat_p95'] = percentile(latencies, 95) * 1e3
+    r['lat_max'] = max(latencies) * 1e3 if latencies else 0
+    return r
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--sensors', default='1,10,50',
+                      help='comma-separated sensor counts per type')
+    parser.add_option('--map-sizes', dest='map_sizes', default='10,40,160',
+                      help='comma-separated sensor_map sizes')
+    parser.add_option('--types', default='2f',
+                      help='tfrec -T mask of the simulated sensor types')
+    parser.add_option('--rate', type=float, default=0,
+                      help='telegrams per second, 0 for as fast as possible')
+    parser.add_option('--count', type=int, default=20000,
+                      help='telegrams per run')
+    parser.add_option('--reader', default='thread',
+                      help='driver reader: thread, chunk or select')
+    parser.add_option('--ingest', default='debug',
+                      help='driver ingest: debug or handler')
+    (options, _) = parser.parse_args()
+    if tfrc.DriverStats.CLOCK_NAME != 'thread_time':
+        parser.error('the stage timings need python 3.7 or later')
+
+    columns = ['lines', 'packets', 'read'] + STAGES + [
+        'lat_mean', 'lat_p95', 'lat_max']
+    print('%7s %5s ' % ('sensors', 'map') +
+          ' '.join('%9s' % c for c in columns))
+    for sensors in [int(x) for x in options.sensors.split(',')]:
+        for map_size in [int(x) for x in options.map_sizes.split(',')]:
+            r = run(options, sensors, map_size)
+            print('%7d %5d ' % (sensors, map_size) +
+                  ' '.join('%9.1f' % r[c] for c in columns))
+
+if __name__ == '__main__':
+    main()
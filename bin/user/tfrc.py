@@ -31,6 +31,20 @@ stanza.  For example:
 
 If no sensor_map is specified, no data will be collected.
 
+The TFA_2, TFA_3, TX22 and WeatherHub sensors send several kinds of values,
+which tfrec prints as subtypes of the sensor, one line each.  The lines of a
+transmission become one packet, and the hardware_id is the identifier without
+the subtype.  Depending on the sensor, the observations include temperature,
+humidity, temperature_ext, rain_count, rain_total (cm, WeatherHub only),
+rain_age, wind_speed and wind_gust (km/h), wind_dir, state and state_age, and
+temperature_1 to temperature_3 and humidity_1 to humidity_3 for the extra
+sensors of a WeatherHub station.  For example:
+
+    [[sensor_map]]
+        windSpeed = wind_speed.0B3D9DDEEABC.WeatherHubPacket
+        windDir = wind_dir.0B3D9DDEEABC.WeatherHubPacket
+        extraTemp1 = temperature_1.117ADDAF2FF6.WeatherHubPacket
+
 The deltas stanza indicates which observations are cumulative measures and
 how they should be split into delta measures.
 
@@ -53,6 +67,246 @@ not yet recognized by your configuration.
 
 The default for each of these is False.
 
+Some WeatherHub sensors send a history of their previous values along with
+each telegram, which tfrec prints with -DD.  With history_interval, the
+driver keeps the last history_size values of each sensor, and at startup
+makes archive records of history_interval seconds from them for the time
+that weewx was not running.  Since the history comes with the telegrams, the
+driver listens for history_wait seconds before it makes these records.  The
+history_interval should be the archive_interval of weewx.  The history lines
+are not documented by tfrec, and the format that the driver reads has not
+been checked against the output of a real tfrec, so this is experimental.
+
+[TFRC]
+    ...
+    cmd = tfrec -DD -T 20
+    history_interval = 300
+    history_wait = 120
+
+Sensors repeat their telegrams.  A telegram with the same sensor, sequence
+number and timestamp as one received within the last dedup_window seconds is
+dropped.  Use 0 to disable this.
+
+[TFRC]
+    ...
+    dedup_window = 30
+
+The sequence numbers of the telegrams from a sensor tell how many telegrams
+were missed.  With loss_fields, each packet gets an observation 'loss' with
+the percentage of telegrams lost by the sensor over its last 64 telegrams,
+which can be mapped like any other observation, for example:
+
+    [[sensor_map]]
+        extraLoss1 = loss.65B0.TFA_1Packet
+
+With reception_log_interval, a summary of the telegrams received and
+expected, the gaps and the rssi of each sensor is logged every so many
+seconds.  Each of these is off by default.
+
+[TFRC]
+    ...
+    loss_fields = True
+    reception_log_interval = 3600
+
+Restarting weewx restarts tfrec, and the receiver loses telegrams while it
+starts up again.  To keep tfrec running, run the collector on its own:
+
+  python tfrc.py --action=collect --ring=/var/lib/tfrc/ring --config=weewx.conf
+
+The collector runs tfrec with the handler, and writes each telegram to a
+ring of fixed-size records in a memory-mapped file.  With ring_file, the
+driver reads that file instead of running tfrec.  The driver saves its
+position in the ring, so after a restart it continues with the telegrams
+that arrived while weewx was not running.
+
+[TFRC]
+    ...
+    ring_file = /var/lib/tfrc/ring
+
+When tfrec exits, or prints nothing for a long time, the driver restarts it
+without involving weewx.  A tfrec has stalled when it has printed nothing for
+ten times its usual interval between telegrams, and for at least
+stall_timeout seconds.  The delay before a restart doubles with each restart
+that produces no telegrams.  After max_restarts such restarts in a row, the
+driver gives up and weewx restarts it.  Use 0 to disable restarts or stall
+detection.  Each tfrec is recorded in the pid_file, so that one left behind by
+a previous run is killed before starting again.  By default the pid_file is
+/var/run/tfrc-<config>.pid, named for the weewx configuration file, and there
+is none when /var/run is not a directory that only root can write.  A pid_file
+that belongs to another user is ignored.
+
+[TFRC]
+    ...
+    max_restarts = 5
+    stall_timeout = 120
+    pid_file = /var/run/tfrc-weewx.pid
+
+The gain (-g), trigger level (-t) and center frequency (-f) of tfrec can be
+found automatically.  With auto_tune, the driver runs tfrec with each of the
+tune_gains in turn for tune_window seconds, then with each of the
+tune_triggers and the best gain, then with the center frequency corrected by
+the mean offset that the sensors report.  It keeps the options with which
+the most telegrams per minute were received from the mapped sensors, and
+logs them so that they can be put in the cmd.  The result is saved in the
+tune_file, and the driver runs tfrec with it from then on instead of tuning
+again, until the cmd is changed or the tune_file is removed.  By default the
+tune_file is next to the pid_file, which does not outlast a reboot, so use a
+directory such as /var/lib/tfrc to keep it.  A gain of -1 is automatic gain
+and a trigger level of 0 is automatic.  This only works with a single cmd.
+
+[TFRC]
+    ...
+    auto_tune = True
+    tune_window = 600
+    tune_gains = -1, 20, 30, 40, 49
+    tune_triggers = 0, 200, 400, 700
+    tune_file = /var/lib/tfrc/tune
+
+On a small computer such as a Raspberry Pi Zero, tfrec keeps a core busy.  If
+one value per sensor for each archive interval is enough, run tfrec for only
+duty_window seconds of every duty_interval seconds.  The window ends a few
+seconds before each interval boundary.  tfrec then runs with -w and -m 1, and
+runs the handler once for each sensor with its latest values as it exits.
+Nothing runs between the windows.  The duty_interval should be the
+archive_interval of weewx, and the window long enough for every sensor to be
+heard at least once.  This implies ingest = handler.
+
+[TFRC]
+    ...
+    duty_window = 60
+    duty_interval = 300
+
+By default the driver parses the -D debug output of tfrec.  With ingest set to
+handler, the driver runs tfrec quietly with a handler (-q -e) instead, and
+parses the compact records that the handler prints for each telegram:
+
+  <id> <temp> <hum> <seq> <batfail> <rssi> <timestamp>
+
+These records are cheaper to parse than the debug output, and have the same
+layout for every sensor type.  The -D options in the cmd are dropped.  The
+handler must print its arguments on one line, like echo does.
+
+[TFRC]
+    ...
+    ingest = handler
+    handler = /bin/echo
+
+To cover more sensors, run several receivers, for example with different
+sticks (-d) or center frequencies (-f), by giving a list of commands.  Their
+output is merged into one stream.  Since a telegram is often received by
+more than one receiver, each packet is held for merge_window seconds, and of
+the copies of a telegram received in that time only the one with the best
+rssi is kept.
+
+[TFRC]
+    ...
+    cmd = tfrec -D -d 0, tfrec -D -d 1 -T 20
+    merge_window = 1.0
+
+Each mapped telegram becomes a loop packet of its own.  With many sensors,
+that means many small packets, each of which goes through every weewx
+service.  With a coalesce_window, the fields received within that many
+seconds are merged into one loop packet, with the timestamp of the latest
+telegram.  The packet is passed on early when a field would be overwritten,
+or when tfrec is idle for idle_timeout seconds.
+
+[TFRC]
+    ...
+    coalesce_window = 10
+
+The lines from the reader threads wait in a queue until the driver gets to
+them, for example while weewx is busy generating reports.  The queue_size
+bounds the number of waiting lines.  When the queue is full, the
+queue_policy decides what happens: 'block' stops reading, so that tfrec
+waits; 'drop-oldest' drops the oldest line; 'keep-latest' drops an older
+line from the same sensor, so that only the latest reading of each sensor
+is kept.  The number of lines dropped is logged and included in the stats.
+The default queue_size of 0 means no bound.
+
+[TFRC]
+    ...
+    queue_size = 1000
+    queue_policy = keep-latest
+
+With stats_file, the driver counts the lines it reads and parses for each
+sensor type, the lines it does not recognize, the packets that are unmapped
+or dropped as duplicates, and the ignored counter decrements.  It also adds
+up the CPU time of the driver thread spent in each stage (wall time before
+python 3.7, which has no clock for the time of a thread).  A snapshot of these, with the depth of the
+queues from the reader threads, is written as json to stats_file every
+stats_interval seconds, and whenever the driver receives SIGUSR1.
+
+[TFRC]
+    ...
+    stats_file = /var/tmp/tfrc-stats.json
+    stats_interval = 300
+
+With profile_dir, the driver can be profiled while it runs.  SIGUSR2 starts
+a profile, and a second SIGUSR2 ends it and writes tfrc-<time>.prof, which
+can be read with pstats, and tfrc-<time>.mem, with the memory allocated by
+each line of code and its growth during the profile, to profile_dir.  With
+profile_duration, a profile ends by itself after so many seconds.  With
+profile = True, a profile starts when the driver starts.  Nothing is
+profiled unless a profile is running.
+
+[TFRC]
+    ...
+    profile_dir = /var/tmp
+    profile_duration = 600
+
+Each telegram is passed to weewx as soon as tfrec prints it.  When tfrec
+prints nothing for idle_timeout seconds, the driver emits a packet with no
+observations so that weewx gets control back.  Use 0 to disable this.  The
+packet has the current time, except with replay_file or ring_file, where the
+telegrams can be older: then it has the time of the last packet, so that the
+time of the packets never goes back.
+
+[TFRC]
+    ...
+    idle_timeout = 10
+
+The output of tfrec is read by one thread per pipe by default.  The chunk
+reader also uses threads, but reads the pipes in large chunks and queues the
+lines of each chunk together, which copes better with bursts of output.
+With the select reader, both pipes are read in the driver thread instead,
+and the lines go straight to the parser without passing through a queue.
+This saves the threads, but the pipes are only read while the driver waits
+for tfrec.  While weewx is busy, for example making reports, a tfrec that
+writes a lot to stderr can fill that pipe and stall until the driver reads
+again.  Use one of the other readers if that matters.
+
+[TFRC]
+    ...
+    reader = select
+
+To add the sensors to the loop packets of another station driver, for
+example extra temperature and humidity channels next to a wired console,
+run the driver as a service instead.  The [TFRC] stanza is the same, except
+that it needs no driver, and max_age is the number of seconds that a value
+is passed on after the sensor was last heard.
+
+[Engine]
+    [[Services]]
+        data_services = user.tfrc.TFRCService
+
+[TFRC]
+    max_age = 300
+    [[sensor_map]]
+        extraTemp1 = temperature.25A6.TFA_1Packet
+
+Output captured with 'tfrec -D' can be replayed from a file instead of running
+tfrec, for example to tune the sensor map or to backfill.  Replay is a mode
+for tests and benchmarks, not for a station.  A replay_speed of 0 replays as
+fast as possible, 1 paces the replay in real time using the tfrec timestamps.
+At the end of the file the driver stays idle.  With replay_hold = False it
+fails instead, and weewx restarts it, which replays the file again.
+
+[TFRC]
+    ...
+    replay_file = /var/tmp/tfrec.txt
+    replay_speed = 0
+    replay_hold = True
+
 """
 from __future__ import print_function  # Python 2/3 compatiblity
 from __future__ import with_statement
@@ -61,12 +315,19 @@ from subprocess import Popen,PIPE
 from subprocess import check_output
 import signal
 from calendar import timegm
+from collections import OrderedDict, deque
 import fnmatch
+import json
+import math
+import mmap
 import os
 import re
+import struct
 import subprocess
+import sys
 import threading
 import time
+import traceback
 
 # Python 2/3 compatiblity
 try:
@@ -74,8 +335,15 @@ try:
 except ImportError:
     import queue            # python 3
 
+try:
+    import selectors        # python 3.4+
+except ImportError:
+    selectors = None
+
 import weewx.drivers
+import weewx.engine
 import weewx.units
+import weeutil.weeutil
 from weeutil.weeutil import tobool
 
 try:
@@ -219,22 +487,54 @@ schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
 # -t: Manually set trigger level (usually 200-1000). If 0, the level is adjusted 
 #     automatically (default)
 #
-# NOTE: the tfrc.py driver use the -D option output; without this option it won't work !!!
+# NOTE: the tfrc.py driver uses the -D option output, unless ingest = handler,
+# in which case it runs tfrec with -q -e and parses the handler records.
 DEFAULT_CMD = 'tfrec -D' 
 
+# the handler that tfrec runs for each telegram with ingest = handler
+DEFAULT_HANDLER = '/bin/echo'
+
+# the directory for the pid files of the running tfrec processes
+PID_DIR = '/var/run'
+
+def get_pid_file(config_path=None):
+    # one pid file for each weewx configuration, so that two instances do not
+    # kill each other's tfrec.  the directory must belong to root, so that no
+    # other user can plant pids in it.
+    try:
+        st = os.stat(PID_DIR)
+    except OSError:
+        return None
+    if st.st_uid != 0 or not os.access(PID_DIR, os.W_OK):
+        return None
+    name = os.path.splitext(os.path.basename(config_path or 'weewx.conf'))[0]
+    return os.path.join(PID_DIR, 'tfrc-%s.pid' % name)
+
 def loader(config_dict, _):
-    return TFRCDriver(**config_dict[DRIVER_NAME])
+    stn_dict = dict(config_dict[DRIVER_NAME])
+    stn_dict.setdefault('pid_file',
+                        get_pid_file(config_dict.get('config_path')))
+    return TFRCDriver(**stn_dict)
 
 def confeditor_loader():
     return TFRCConfigurationEditor()
 
 
 class AsyncReader(threading.Thread):
+    # read a pipe and put lists of decoded lines onto a queue.  by default
+    # each line is read and queued on its own.  in chunked mode, the pipe is
+    # read in large chunks and all of the complete lines in a chunk are
+    # queued as one batch, so a burst of output costs one queue operation.
+    # None is queued once the pipe has been closed.
 
-    def __init__(self, fd, queue, label):
+    CHUNK_SIZE = 65536
+
+    def __init__(self, fd, queue, label, chunked=False, progress=None):
         threading.Thread.__init__(self)
         self._fd = fd
         self._queue = queue
+        self._chunked = chunked
+        self._progress = progress
         self._running = False
         self.setDaemon(True)
         self.setName(label)
@@ -242,98 +542,1219 @@ class AsyncReader(threading.Thread):
     def run(self):
         logdbg("start async reader for %s" % self.getName())
         self._running = True
-        for line in iter(self._fd.readline, ''):
-            self._queue.put(line)
+        try:
+            if self._chunked:
+                self._read_chunks()
+            else:
+                self._read_lines()
+        finally:
+            self._queue.put(None)
+
+    def _read_lines(self):
+        for line in iter(self._fd.readline, b''):
+            if self._progress is not None:
+                self._progress.update()
+            self._queue.put([line.decode('utf-8', 'replace').rstrip('\n')])
             if not self._running:
                 break
 
+    def _read_chunks(self):
+        buf = LineBuffer()
+        fd = self._fd.fileno()
+        while self._running:
+            data = os.read(fd, AsyncReader.CHUNK_SIZE)
+            lines = buf.feed(data) if data else buf.flush()
+            if lines:
+                if self._progress is not None:
+                    self._progress.update(len(lines))
+                self._queue.put(lines)
+            if not data:
+                break
+
     def stop_running(self):
         self._running = False
 
 
-class ProcManager():
-    TS = re.compile(' {10}')
+class LineBuffer(object):
+    # split chunks of bytes from a pipe into lines.  a partial line at the
+    # end of a chunk is carried over to the next chunk.  the complete lines
+    # of each chunk are decoded in one go.
 
     def __init__(self):
-        self._cmd = None
-        self._process = None
-        self.stdout_queue = queue.Queue()
-        self.stdout_reader = None
-        self.stderr_queue = queue.Queue()
-        self.stderr_reader = None
+        self._carry = b''
+
+    def feed(self, data):
+        if self._carry:
+            data = self._carry + data
+        idx = data.rfind(b'\n')
+        if idx < 0:
+            self._carry = data
+            return []
+        self._carry = data[idx + 1:]
+        return data[:idx].decode('utf-8', 'replace').split('\n')
+
+    def flush(self):
+        # return whatever is left once the pipe is closed
+        lines = [self._carry.decode('utf-8', 'replace')] if self._carry else []
+        self._carry = b''
+        return lines
 
-    def get_pid(self, name):
-        return map(int,check_output(["pidof",name]).split())
 
-    def startup(self, cmd, path=None, ld_library_path=None):
-        # kill existiing tfrec processes
+class SelectReader(object):
+    # read the stdout and stderr pipes of processes from the calling thread
+    # by multiplexing them with selectors.  stdout lines are returned to the
+    # caller directly.  stderr is drained whenever stdout is read, into a
+    # bounded buffer.  the pipes are only read while the caller is in read,
+    # so unlike the reader threads this does not drain stderr continuously:
+    # while weewx is busy elsewhere, a chatty stderr can fill its pipe and
+    # stall the process.  that is the price of having no threads.
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, max_stderr=100):
+        self._selector = selectors.DefaultSelector()
+        self.stderr_lines = deque(maxlen=max_stderr)
+
+    def register(self, fileobj, is_stdout, progress=None):
+        self._selector.register(
+            fileobj, selectors.EVENT_READ, (is_stdout, LineBuffer(), progress))
+
+    def unregister(self, fileobj):
         try:
-            pid_list = self.get_pid("tfrec")
-            for pid in pid_list:
-                os.kill(int(pid), signal.SIGKILL)
-                loginf("tfrec with pid %s killed" % pid)
-        except:
-            pass
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass # already unregistered at the end of its output
+
+    def close(self):
+        self._selector.close()
+
+    def read(self, timeout):
+        # return the stdout lines read within timeout seconds, or None once
+        # every pipe has been closed.
+        if not self._selector.get_map():
+            return None
+        lines = []
+        for key, _ in self._selector.select(timeout):
+            is_stdout, buf, progress = key.data
+            data = os.read(key.fd, SelectReader.CHUNK_SIZE)
+            if data:
+                new_lines = buf.feed(data)
+            else:
+                self._selector.unregister(key.fileobj)
+                new_lines = buf.flush()
+            if is_stdout:
+                lines.extend(new_lines)
+                if progress is not None and new_lines:
+                    progress.update(len(new_lines))
+            else:
+                self.stderr_lines.extend(new_lines)
+        return lines
 
-        self._cmd = cmd
-        loginf("startup process '%s'" % self._cmd)
-        env = os.environ.copy()
+
+class LineQueue(object):
+    # a queue of lines between a reader thread and the driver, optionally
+    # bounded.  the reader puts batches of lines, the driver gets all of the
+    # queued lines at once.  when the queue is full, the policy decides what
+    # happens to a new line:
+    #   block       - the reader waits, so the output of the process backs
+    #                 up in the pipe
+    #   drop-oldest - the oldest line is dropped
+    #   keep-latest - an older line from the same sensor is dropped, so that
+    #                 only the latest reading of each sensor is kept.  if there
+    #                 is none, the oldest line is dropped.  the queued lines
+    #                 are entries [line, sensor], and the entries of each
+    #                 sensor are indexed, oldest first.  a dropped entry is
+    #                 emptied in place, so that nothing is removed from the
+    #                 middle of the deque.
+    # each reader that puts lines is a producer.  a producer puts None when
+    # its output ends, and the queue ends once every producer has ended.
+
+    POLICIES = ['block', 'drop-oldest', 'keep-latest']
+
+    def __init__(self, max_lines=0, policy='drop-oldest'):
+        if policy not in LineQueue.POLICIES:
+            raise weewx.ViolatedPrecondition("unknown policy '%s'" % policy)
+        self._lines = deque()
+        self._max_lines = max_lines
+        self._policy = policy
+        self._closed = False
+        self._producers = 0
+        self._cond = threading.Condition()
+        self._latest = None # sensor -> deque of entries, with keep-latest
+        self._size = 0 # lines in the entries that have not been dropped
+        if policy == 'keep-latest' and max_lines:
+            self._latest = dict()
+        self.dropped = 0
+
+    @staticmethod
+    def get_sensor(line):
+        # the identifier of the sensor that sent a line, or None
+        idx = line.find(' ID ')
+        if idx >= 0:
+            fields = line[idx + 4:].split(None, 1)
+            return fields[0] if fields else None
+        for field in line.split()[2:]:
+            if len(field) == 13:
+                return field # WeatherHub, with the subtype
+        return None
+
+    def add_producer(self):
+        with self._cond:
+            self._producers += 1
+
+    def put(self, batch):
+        with self._cond:
+            if batch is None:
+                self._producers -= 1
+                self._closed = self._producers <= 0
+            else:
+                for line in batch:
+                    self._put_line(line)
+            self._cond.notify_all()
+
+    def _put_line(self, line):
+        if self._latest is not None:
+            self._put_latest(line)
+            return
+        lines = self._lines
+        if self._max_lines and len(lines) >= self._max_lines:
+            if self._policy == 'block':
+                while len(lines) >= self._max_lines:
+                    self._cond.wait()
+            else:
+                lines.popleft()
+                self._count_dropped()
+        lines.append(line)
+
+    def _put_latest(self, line):
+        lines = self._lines
+        sensor = LineQueue.get_sensor(line)
+        if self._size >= self._max_lines:
+            entries = self._latest.get(sensor) if sensor is not None else None
+            if entries:
+                old = entries.popleft()
+            else:
+                while lines[0][0] is None:
+                    lines.popleft()
+                old = lines.popleft()
+                if old[1] is not None:
+                    self._latest[old[1]].popleft()
+            if old[1] is not None and not self._latest[old[1]]:
+                del self._latest[old[1]]
+            old[0] = None
+            self._size -= 1
+            self._count_dropped()
+            if len(lines) > 2 * self._max_lines:
+                self._lines = lines = deque(e for e in lines
+                                            if e[0] is not None)
+        entry = [line, sensor]
+        lines.append(entry)
+        self._size += 1
+        if sensor is not None:
+            self._latest.setdefault(sensor, deque()).append(entry)
+
+    def _count_dropped(self):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            loginf("queue full, %d lines dropped" % self.dropped)
+
+    def get(self, block=True, timeout=None):
+        # return a list of all the queued lines, or None at the end of the
+        # output.  raise queue.Empty if there is nothing within timeout.
+        with self._cond:
+            if block and timeout is not None:
+                deadline = time.time() + timeout
+            while block and not self._lines and not self._closed:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if self._lines:
+                if self._latest is not None:
+                    batch = [e[0] for e in self._lines if e[0] is not None]
+                    self._latest.clear()
+                    self._size = 0
+                else:
+                    batch = list(self._lines)
+                self._lines.clear()
+                self._cond.notify_all()
+                return batch
+            if self._closed:
+                return None
+            raise queue.Empty
+
+    def qsize(self):
+        if self._latest is not None:
+            return self._size
+        return len(self._lines)
+
+    def empty(self):
+        return not self.qsize()
+
+
+class Progress(object):
+    # the output of a receiver so far, updated by whatever reads its stdout.
+    # the mean interval between lines is the cadence at which its sensors
+    # are heard.
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.lines = 0
+
+    def update(self, n=1):
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.lines += n
+
+    @property
+    def interval(self):
+        if self.lines < 2:
+            return None
+        return (self.last - self.first) / (self.lines - 1)
+
+
+class Receiver(object):
+    # a tfrec command, its current process and the readers of its pipes
+
+    def __init__(self, cmd, label=''):
+        self.cmd = cmd
+        self.label = label
+        self.process = None
+        self.readers = []
+        self.progress = Progress()
+        self.failures = 0 # restarts without output since
+        self.restarts = 0
+        self.restart_at = None
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+
+class ProcManager():
+    # run one or more tfrec processes, for example one for each RTL-SDR
+    # stick, and merge their output into one stream of lines.  each process
+    # runs in a process group of its own, so that it can be killed together
+    # with any handlers that it started.  the groups are recorded in a pid
+    # file, so that a process left behind by a previous instance is killed
+    # before starting again.
+    #
+    # with max_restarts, a process that exits or stalls is restarted in
+    # place, after a delay that doubles with each restart that produced no
+    # output, up to max_restarts restarts in a row.  a process stalls when it
+    # prints nothing for STALL_FACTOR times its usual interval between lines,
+    # and for at least stall_timeout seconds.
+
+    # how often to check whether the process is still running, in seconds
+    POLL_INTERVAL = 5
+
+    # the ways in which the output of the process can be read:
+    #   thread - one reader thread per pipe, lines are passed on a queue
+    #   chunk  - like thread, but the pipes are read in large chunks and the
+    #            lines of each chunk are passed on the queue as one batch
+    #   select - all pipes are multiplexed in the thread that reads lines
+    READERS = ['thread', 'chunk', 'select']
+
+    # bound on the lines from stderr that are waiting to be logged
+    MAX_STDERR_LINES = 1000
+
+    # delay before the first restart and the bound on it, in seconds
+    RESTART_DELAY = 2
+    MAX_RESTART_DELAY = 300
+
+    STALL_FACTOR = 10
+
+    def __init__(self, reader='thread', queue_size=0,
+                 queue_policy='drop-oldest', max_restarts=0, stall_timeout=0,
+                 pid_file=None):
+        self._cmds = []
+        self._receivers = []
+        if reader == 'select' and selectors is None:
+            loginf("select reader is not available, using threads")
+            reader = 'thread'
+        elif reader not in ProcManager.READERS:
+            raise weewx.ViolatedPrecondition("unknown reader '%s'" % reader)
+        self._reader = reader
+        self._max_restarts = max_restarts
+        self._stall_timeout = stall_timeout
+        self._pid_file = pid_file
+        self._env = None
+        self._running = False
+        # the lines that have been read but not yet passed on.  a parser may
+        # take the other lines of a transmission from here.
+        self.pending = deque()
+        self.stdout_queue = LineQueue(queue_size, queue_policy)
+        self.stderr_queue = LineQueue(ProcManager.MAX_STDERR_LINES)
+        self._select_reader = None
+        # the stopped processes whose readers have not finished yet
+        self._lingering = [] # [(process, readers), ...]
+
+    def startup(self, cmd, path=None, ld_library_path=None):
+        # the cmd is a command or a list of commands
+        self._cmds = cmd if isinstance(cmd, list) else [cmd]
+        self._kill_stale()
+        self._env = os.environ.copy()
         if path:
-            env['PATH'] = path + ':' + env['PATH']
+            self._env['PATH'] = path + ':' + self._env['PATH']
         if ld_library_path:
-            env['LD_LIBRARY_PATH'] = ld_library_path
+            self._env['LD_LIBRARY_PATH'] = ld_library_path
+        if self._reader == 'select':
+            self._select_reader = SelectReader()
+        if self._max_restarts:
+            # the supervisor keeps the queue open while processes restart
+            self.stdout_queue.add_producer()
+        self._running = True
+        for i, c in enumerate(self._cmds):
+            receiver = Receiver(c, '-%d' % i if len(self._cmds) > 1 else '')
+            self._receivers.append(receiver)
+            self._start(receiver)
+        self._write_pid_file()
+
+    def _start(self, receiver):
+        loginf("startup process '%s'" % receiver.cmd)
+        # each tfrec leads its own process group, so that the group can be
+        # killed.  preexec_fn is not safe while the reader threads run, so it
+        # is only for python 2, which has no start_new_session.
+        if sys.version_info >= (3, 2):
+            session = dict(start_new_session=True)
+        else:
+            session = dict(preexec_fn=os.setsid)
         try:
-            self._process = subprocess.Popen(cmd.split(' '),
-                                             env=env,
-                                             stdout=subprocess.PIPE,
-                                             stderr=subprocess.PIPE)
-            self.stdout_reader = AsyncReader(
-                self._process.stdout, self.stdout_queue, 'stdout-thread')
-            self.stdout_reader.start()
-            self.stderr_reader = AsyncReader(
-                self._process.stderr, self.stderr_queue, 'stderr-thread')
-            self.stderr_reader.start()
+            process = subprocess.Popen(receiver.cmd.split(' '),
+                                       env=self._env,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       **session)
         except (OSError, ValueError)as e:
             raise weewx.WeeWxIOError("failed to start process: %s" % e)
+        receiver.process = process
+        receiver.progress = Progress()
+        if self._select_reader is not None:
+            self._select_reader.register(
+                process.stdout, True, receiver.progress)
+            self._select_reader.register(process.stderr, False)
+        else:
+            chunked = self._reader == 'chunk'
+            for fd, q, label, progress in [
+                (process.stdout, self.stdout_queue, 'stdout-thread',
+                 receiver.progress),
+                (process.stderr, self.stderr_queue, 'stderr-thread', None)]:
+                q.add_producer()
+                reader = AsyncReader(fd, q, label + receiver.label, chunked,
+                                     progress)
+                reader.start()
+                receiver.readers.append(reader)
+
+    def _stop(self, receiver):
+        for reader in receiver.readers:
+            reader.stop_running()
+        process = receiver.process
+        if process is None:
+            return
+        if process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                process.kill()
+            process.wait()
+        # the readers see the end of the pipes once the process is gone
+        for reader in receiver.readers:
+            reader.join(1)
+        if self._select_reader is not None:
+            self._select_reader.unregister(process.stdout)
+            self._select_reader.unregister(process.stderr)
+        # a reader that is still busy, for example waiting to put lines on a
+        # full queue, is kept with its pipes until it has finished
+        self._lingering.append((process, receiver.readers))
+        receiver.readers = []
+        self._reap()
+
+    def _reap(self):
+        # close the pipes of the stopped processes whose readers are done
+        lingering = []
+        for process, readers in self._lingering:
+            if any(reader.is_alive() for reader in readers):
+                lingering.append((process, readers))
+            else:
+                process.stdout.close()
+                process.stderr.close()
+        self._lingering = lingering
 
     def shutdown(self):
-        loginf('shutdown process %s' % self._cmd)
-        self.stdout_reader.stop_running()
-        self.stderr_reader.stop_running()
-        # kill existiing tfrec processes
-        pid_list = self.get_pid("tfrec")
-        for pid in pid_list:
-            os.kill(int(pid), signal.SIGKILL)
-            loginf("tfrec with pid %s killed" % pid)
+        loginf('shutdown process %s' % ', '.join(self._cmds))
+        self._running = False
+        for receiver in self._receivers:
+            self._stop(receiver)
+        if self._lingering:
+            # the lines are not wanted any more, so make room for the readers
+            # that wait to put theirs, and let them finish
+            for q in [self.stdout_queue, self.stderr_queue]:
+                try:
+                    q.get(block=False)
+                except queue.Empty:
+                    pass
+            for _, readers in self._lingering:
+                for reader in readers:
+                    reader.join(1)
+            self._reap()
+        if self._select_reader is not None:
+            self._select_reader.close()
+        if self._max_restarts:
+            self.stdout_queue.put(None)
+        if self._pid_file:
+            try:
+                os.unlink(self._pid_file)
+            except OSError:
+                pass
+
+    def restart(self, cmd, index=0):
+        # run a receiver with another command from now on, for example with
+        # other tuning options.  the queue stays open in the meantime.
+        receiver = self._receivers[index]
+        loginf("restart process '%s' as '%s'" % (receiver.cmd, cmd))
+        self.stdout_queue.add_producer()
+        try:
+            self._stop(receiver)
+            receiver.cmd = self._cmds[index] = cmd
+            receiver.restart_at = None
+            receiver.failures = 0
+            self._start(receiver)
+        finally:
+            self.stdout_queue.put(None)
+        self._write_pid_file()
+
+    def _write_pid_file(self):
+        if not self._pid_file:
+            return
+        try:
+            with open(self._pid_file, 'w') as f:
+                f.write('%s\n' % ' '.join(
+                    str(r.process.pid) for r in self._receivers
+                    if r.process is not None))
+        except (IOError, OSError) as e:
+            logerr("cannot write pid file: %s" % e)
+
+    def _kill_stale(self):
+        # kill the process groups in the pid file, if they are still running
+        # the same program.  this checks /proc, so that a pid that has been
+        # reused since is not killed.
+        if not self._pid_file:
+            return
+        try:
+            with open(self._pid_file) as f:
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    loginf("pid file %s has another owner" % self._pid_file)
+                    return
+                pids = [int(x) for x in f.read().split()]
+        except (IOError, OSError, ValueError):
+            return
+        names = [os.path.basename(c.split()[0]) for c in self._cmds] or \
+            [os.path.basename(DEFAULT_CMD.split()[0])]
+        for pid in pids:
+            try:
+                with open('/proc/%d/cmdline' % pid, 'rb') as f:
+                    cmdline = f.read().decode('utf-8', 'replace')
+                if any(name in cmdline for name in names):
+                    os.killpg(pid, signal.SIGKILL)
+                    loginf("process group %s killed" % pid)
+            except (IOError, OSError):
+                pass
 
     def running(self):
-        return self._process.poll() is None
+        return any(r.running() for r in self._receivers)
+
+    @property
+    def receivers(self):
+        return len(self._cmds)
+
+    def supervise(self):
+        # restart the processes that have exited or stalled.  return False
+        # if a process has been restarted too often without output.
+        now = time.time()
+        if self._lingering:
+            self._reap()
+        for r in self._receivers:
+            if r.restart_at is None:
+                if r.running():
+                    if not self._stalled(r, now):
+                        continue
+                    logerr("process '%s' stalled for %.0f seconds" % (
+                        r.cmd, now - r.progress.last))
+                else:
+                    logerr("process '%s' exited with code %s" % (
+                        r.cmd, r.process.returncode if r.process else None))
+                for line in self.get_stderr():
+                    logerr("err: %s" % line.rstrip())
+                self._stop(r)
+                if r.progress.lines:
+                    r.failures = 0
+                if r.failures >= self._max_restarts:
+                    logerr("process '%s' failed %d times" % (
+                        r.cmd, r.failures))
+                    return False
+                delay = min(ProcManager.RESTART_DELAY * 2 ** r.failures,
+                            ProcManager.MAX_RESTART_DELAY)
+                loginf("restart process in %s seconds" % delay)
+                r.failures += 1
+                r.restart_at = now + delay
+            elif now >= r.restart_at and self._running:
+                r.restart_at = None
+                r.restarts += 1
+                try:
+                    self._start(r)
+                except weewx.WeeWxIOError as e:
+                    logerr("restart failed: %s" % e)
+                    r.process = None
+                self._write_pid_file()
+        return True
+
+    def _stalled(self, receiver, now):
+        progress = receiver.progress
+        if not self._stall_timeout or progress.last is None:
+            return False
+        limit = self._stall_timeout
+        if progress.interval is not None:
+            limit = max(limit, ProcManager.STALL_FACTOR * progress.interval)
+        return now - progress.last > limit
+
+    def _check(self):
+        # whether to keep reading
+        if not self._running:
+            return False
+        if self._max_restarts:
+            return self.supervise()
+        return self.running()
+
+    def queue_depths(self):
+        depths = {'restarts': sum(r.restarts for r in self._receivers)}
+        if self._select_reader is not None:
+            depths['stderr_buffer'] = len(self._select_reader.stderr_lines)
+            return depths
+        depths.update({'stdout_queue': self.stdout_queue.qsize(),
+                       'stdout_dropped': self.stdout_queue.dropped,
+                       'stderr_queue': self.stderr_queue.qsize(),
+                       'stderr_dropped': self.stderr_queue.dropped})
+        return depths
 
     def get_stderr(self):
         lines = []
-        while not self.stderr_queue.empty():
-            lines.append(self.stderr_queue.get().decode('utf-8'))
+        if self._select_reader is not None:
+            while self._select_reader.stderr_lines:
+                lines.append(self._select_reader.stderr_lines.popleft())
+            return lines
+        try:
+            lines.extend(self.stderr_queue.get(False) or [])
+        except queue.Empty:
+            pass
         return lines
 
-    def get_stdout(self):
-        lines = []
-        # When a lot TFA sensors are read (e.g. 10), a hangup
-        # will occur regularly, sometimes of more than a minute.
-        # Therefor a maximum run-time of get_stdout of 10 seconds 
-        # is invoked to let genLoopPackets process the yielded lines. 
-        start_time = int(time.time())
-        while self.running() and int(time.time()) - start_time < 10:
-            try:
-                line = self.stdout_queue.get(True, 3).decode('utf-8')
-                m = ProcManager.TS.search(line)
-                if m and lines:
-                    yield lines
+    def get_lines(self, timeout=None):
+        # yield each line of output as soon as it arrives, so that every
+        # telegram is handled without waiting for the ones after it.  if
+        # nothing arrives within timeout seconds, yield None so that the
+        # caller gets control back while the radio is silent.  return once
+        # the process has exited, or with max_restarts, once the process
+        # keeps failing.
+        wait = min(timeout or ProcManager.POLL_INTERVAL,
+                   ProcManager.POLL_INTERVAL)
+        last_check = last_line = time.time()
+        while True:
+            if self._select_reader is not None:
+                lines = self._select_reader.read(wait)
+                if lines is None:
+                    # every pipe has been closed
+                    if not self._max_restarts:
+                        return
+                    time.sleep(wait)
                     lines = []
-                lines.append(line) 
-            except queue.Empty:
-                yield lines
-                lines = []
-        yield lines
+            else:
+                try:
+                    lines = self.stdout_queue.get(True, wait)
+                except queue.Empty:
+                    lines = []
+                if lines is None:
+                    # the readers saw the end of the output
+                    return
+            self.pending.extend(lines)
+            while self.pending:
+                yield self.pending.popleft()
+            now = time.time()
+            if lines:
+                last_line = now
+            if not lines or now - last_check >= ProcManager.POLL_INTERVAL:
+                last_check = now
+                if not self._check():
+                    return
+            if timeout and now - last_line >= timeout:
+                yield None
+                last_line = now
+
+
+class ReplayManager(object):
+    # replay captured tfrec -D output from a file in place of a running
+    # tfrec process.  the file is read in large chunks.  lines are passed
+    # on as fast as possible, or paced by the tfrec timestamps: a speed of
+    # 1 is real time, 2 is twice as fast, and so on.  when hold is set, the
+    # replay stays idle at the end of the file until it is shut down, which
+    # keeps weewx from restarting the driver and replaying again.
+
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, filename, speed=0, hold=False):
+        self._filename = filename
+        self._speed = speed
+        self._hold = hold
+        self._file = None
+        self._running = False
+        self._stopped = threading.Event() # ends the hold
+        self.pending = deque()
+
+    def startup(self, cmd=None, path=None, ld_library_path=None):
+        loginf("replay '%s' at speed %s" % (self._filename, self._speed))
+        self._stopped.clear()
+        try:
+            self._file = open(self._filename, 'rb')
+        except (IOError, OSError) as e:
+            raise weewx.WeeWxIOError("failed to open replay file: %s" % e)
+        self._running = True
+
+    def shutdown(self):
+        loginf("shutdown replay of '%s'" % self._filename)
+        self._running = False
+        self._stopped.set()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def running(self):
+        return self._running
+
+    def get_stderr(self):
+        return []
+
+    def queue_depths(self):
+        return {}
+
+    @staticmethod
+    def get_timestamp(line):
+        # the timestamp of a telegram, or None for any other line
+        fields = line.split(None, 2)
+        if len(fields) > 1 and fields[0][:1] == '#':
+            try:
+                return int(fields[1])
+            except ValueError:
+                pass
+        return None
+
+    def get_lines(self, timeout=None):
+        # like ProcManager.get_lines, but the lines come from the file
+        buf = LineBuffer()
+        t0 = ts0 = None
+        while self._running:
+            data = self._file.read(ReplayManager.CHUNK_SIZE)
+            self.pending.extend(buf.feed(data) if data else buf.flush())
+            while self.pending:
+                line = self.pending.popleft()
+                ts = ReplayManager.get_timestamp(line) if self._speed else None
+                if ts is not None:
+                    if ts0 is None:
+                        t0, ts0 = time.time(), ts
+                    due = t0 + (ts - ts0) / float(self._speed)
+                    while self._running:
+                        delay = due - time.time()
+                        if delay <= 0:
+                            break
+                        if timeout and delay > timeout:
+                            time.sleep(timeout)
+                            yield None
+                        else:
+                            time.sleep(delay)
+                yield line
+            if not data:
+                break
+        loginf("replay of '%s' finished" % self._filename)
+        self._running = False
+        while self._hold and not self._stopped.wait(
+                timeout or ProcManager.POLL_INTERVAL):
+            if timeout:
+                yield None
+
+
+class DutyCycleManager(object):
+    # run tfrec for only window seconds of every interval.  tfrec is run
+    # with -w, so that it exits by itself at the end of the window, and with
+    # -m 1, so that it runs the handler once for each sensor as it exits.
+    # each window ends MARGIN seconds before an interval boundary, so that
+    # the values are in before weewx makes the archive record.  nothing runs
+    # in between: no tfrec, and no reader threads.
+
+    MARGIN = 5
+
+    # how long to wait for tfrec to exit after its window, in seconds
+    GRACE = 15
+
+    def __init__(self, window=60, interval=300, reader='thread',
+                 pid_file=None):
+        self._window = window
+        self._interval = interval
+        self._reader = reader
+        self._pid_file = pid_file
+        self._cmd = None
+        self._path = None
+        self._ld_library_path = None
+        self._proc = None
+        self._stderr = []
+        self._running = False
+        self.windows = 0
+        self.pending = deque()
+
+    @staticmethod
+    def get_window_cmd(cmd, window):
+        # the tfrec command for one window
+        parts = cmd.split()
+        parts[1:1] = ['-w', str(window), '-m', '1']
+        return ' '.join(parts)
+
+    def startup(self, cmd, path=None, ld_library_path=None):
+        self._cmd = DutyCycleManager.get_window_cmd(cmd, self._window)
+        self._path = path
+        self._ld_library_path = ld_library_path
+        loginf("run '%s' for %s seconds of every %s" % (
+            self._cmd, self._window, self._interval))
+        self._running = True
+
+    def shutdown(self):
+        self._running = False
+        self._stop()
+
+    def _stop(self):
+        if self._proc is not None:
+            self._proc.shutdown()
+            self._stderr.extend(self._proc.get_stderr())
+            self._proc = None
+
+    def running(self):
+        return self._running
+
+    def get_stderr(self):
+        lines, self._stderr = self._stderr, []
+        if self._proc is not None:
+            lines.extend(self._proc.get_stderr())
+        return lines
+
+    def queue_depths(self):
+        depths = {'windows': self.windows}
+        if self._proc is not None:
+            depths.update(self._proc.queue_depths())
+        return depths
+
+    def next_window(self, now):
+        # the start of the next window that can be listened to in full
+        end = (now // self._interval + 1) * self._interval - \
+            DutyCycleManager.MARGIN
+        start = end - self._window
+        if start < now:
+            start += self._interval
+        return start
+
+    def get_lines(self, timeout=None):
+        # like ProcManager.get_lines, with a pause between the windows
+        wait = timeout or ProcManager.POLL_INTERVAL
+        while self._running:
+            start = self.next_window(time.time())
+            while self._running:
+                delay = start - time.time()
+                if delay <= 0:
+                    break
+                time.sleep(min(delay, wait))
+                if timeout and delay > wait:
+                    yield None
+            if not self._running:
+                return
+            self._proc = ProcManager(self._reader, pid_file=self._pid_file)
+            # the parsers take the lines of a transmission from here
+            self._proc.pending = self.pending
+            self._proc.startup(self._cmd, self._path, self._ld_library_path)
+            deadline = time.time() + self._window + DutyCycleManager.GRACE
+            for line in self._proc.get_lines(wait):
+                if line is not None or timeout:
+                    yield line
+                if time.time() > deadline:
+                    logerr("process '%s' did not exit after its window" %
+                           self._cmd)
+                    break
+            self._stop()
+            self.windows += 1
+
+
+class RingBuffer(object):
+    # a ring of fixed-size telegram records in a memory-mapped file, written
+    # by the collector and read by the driver.  the header has the number of
+    # records ever written, so a reader knows where to continue and how many
+    # records it has missed if it fell more than a ring behind.  the header
+    # also has the time that the ring was created, so that a reader notices
+    # when a ring has been replaced.  there must be only one writer.
+    #
+    # header: magic, version, capacity, created, records written
+    # record: record number, timestamp, id, temp, hum, seq, batfail, rssi
+
+    MAGIC = b'TFRCRING'
+    VERSION = 1
+    HEADER = struct.Struct('<8sIIqq')
+    RECORD = struct.Struct('<qq16sfiiHH')
+    NUMBER = struct.Struct('<q') # the record number at the start of a record
+
+    def __init__(self, filename, capacity=4096, writer=False):
+        self.filename = filename
+        self._writer = writer
+        self._file = None
+        self._map = None
+        self.ino = None
+        self.capacity = capacity
+        self.created = None
+        self._open()
+
+    def _open(self):
+        if self._writer and not self._valid():
+            # start a new ring
+            size = self.HEADER.size + self.capacity * self.RECORD.size
+            with open(self.filename, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                         self.capacity, int(time.time()), 0))
+                f.truncate(size)
+        self._file = open(self.filename, 'r+b' if self._writer else 'rb')
+        self.ino = os.fstat(self._file.fileno()).st_ino
+        self._map = mmap.mmap(
+            self._file.fileno(), 0,
+            access=mmap.ACCESS_WRITE if self._writer else mmap.ACCESS_READ)
+        magic, version, self.capacity, self.created, _ = \
+            self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise weewx.WeeWxIOError("not a ring file: %s" % self.filename)
+
+    def _valid(self):
+        # whether there is a ring of the right size to continue writing
+        try:
+            with open(self.filename, 'rb') as f:
+                header = f.read(self.HEADER.size)
+            magic, version, capacity, _, _ = self.HEADER.unpack(header)
+            return (magic == self.MAGIC and version == self.VERSION and
+                    capacity == self.capacity)
+        except (IOError, OSError, struct.error):
+            return False
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def written(self):
+        return self.HEADER.unpack_from(self._map, 0)[4]
+
+    def _offset(self, n):
+        return self.HEADER.size + (n % self.capacity) * self.RECORD.size
+
+    def append(self, fields):
+        # add a record from the fields of a tfrec handler record.  return
+        # False if the fields are not a handler record.
+        if len(fields) not in [7, 8]:
+            return False
+        try:
+            sensor_id = fields[0].encode('ascii')
+            values = (int(fields[-1]), sensor_id, float(fields[1]),
+                      int(fields[2]), int(fields[3]), int(fields[4]),
+                      int(fields[5]))
+        except (ValueError, UnicodeError):
+            return False
+        n = self.written
+        self.RECORD.pack_into(self._map, self._offset(n), n, *values)
+        # the record is complete before the readers can see it
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self.VERSION,
+                              self.capacity, self.created, n + 1)
+        return True
+
+    def read(self, pos):
+        # return the records from pos as handler record lines, the position
+        # after them, and the number of records that were lost because they
+        # had been overwritten.  the slot of record written - capacity is the
+        # one that the writer fills next, so only the records after it can be
+        # read.
+        written = self.written
+        lost = 0
+        if written - pos >= self.capacity:
+            lost = written - self.capacity + 1 - pos
+            pos = written - self.capacity + 1
+        lines = []
+        while pos < written:
+            offset = self._offset(pos)
+            n, ts, sensor_id, temp, hum, seq, batfail, rssi = \
+                self.RECORD.unpack_from(self._map, offset)
+            # as with a seqlock, the record is good if it still has its
+            # number after it was read, and the writer has not reached it
+            if (n != pos or self.NUMBER.unpack_from(self._map, offset)[0] != n
+                or self.written - pos >= self.capacity):
+                # overwritten while we were reading
+                lost += 1
+            else:
+                lines.append('%s %+.1f %d %d %d %d %d' % (
+                    sensor_id.rstrip(b'\0').decode('ascii'), temp, hum,
+                    seq, batfail, rssi, ts))
+            pos += 1
+        return lines, pos, lost
+
+
+class RingManager(object):
+    # read the telegrams that the collector writes to a ring file, in place
+    # of a running tfrec process.  the position in the ring is saved to a
+    # file next to the ring, so after a restart the driver continues where
+    # it stopped and no telegrams are lost while weewx restarts.  without a
+    # saved position, reading starts with the next telegram.
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._pos_file = filename + '.pos'
+        self._ring = None
+        self._pos = None
+        self._lost = 0
+        self._running = False
+        self.pending = deque()
+
+    def startup(self, cmd=None, path=None, ld_library_path=None):
+        loginf("read ring '%s'" % self._filename)
+        try:
+            self._ring = RingBuffer(self._filename)
+        except (IOError, OSError) as e:
+            raise weewx.WeeWxIOError("failed to open ring file: %s" % e)
+        self._pos = self._load_pos()
+        self._running = True
+
+    def shutdown(self):
+        loginf("shutdown read of ring '%s'" % self._filename)
+        self._running = False
+        if self._ring is not None:
+            self._save_pos()
+            self._ring.close()
+            self._ring = None
+
+    def running(self):
+        return self._running
+
+    def get_stderr(self):
+        return []
+
+    def queue_depths(self):
+        backlog = self._ring.written - self._pos if self._ring else 0
+        return {'ring_backlog': backlog, 'ring_lost': self._lost}
+
+    def _load_pos(self):
+        try:
+            with open(self._pos_file) as f:
+                created, pos = [int(x) for x in f.read().split()]
+            if created == self._ring.created and pos <= self._ring.written:
+                loginf("continue ring at %s" % pos)
+                return pos
+        except (IOError, OSError, ValueError):
+            pass
+        return self._ring.written
+
+    def _save_pos(self):
+        try:
+            tmp = self._pos_file + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write('%d %d\n' % (self._ring.created, self._pos))
+            os.rename(tmp, self._pos_file)
+        except (IOError, OSError) as e:
+            logerr("cannot save ring position: %s" % e)
+
+    def _check_ring(self):
+        # the collector replaced the ring, so start again with the new one
+        try:
+            if os.stat(self._filename).st_ino == self._ring.ino:
+                return
+            ring = RingBuffer(self._filename)
+        except (IOError, OSError, weewx.WeeWxIOError):
+            return
+        loginf("ring '%s' was replaced" % self._filename)
+        self._ring.close()
+        self._ring = ring
+        self._pos = 0
+
+    def get_lines(self, timeout=None):
+        # like ProcManager.get_lines, but the lines come from the ring
+        last = time.time()
+        while self._running:
+            start = self._pos
+            lines, pos, lost = self._ring.read(start)
+            if lost:
+                logerr("lost %d telegrams in the ring" % lost)
+                self._lost += lost
+            self.pending.extend(lines)
+            while self.pending:
+                line = self.pending.popleft()
+                # a line counts as read once it has been passed on
+                self._pos = pos - len(self.pending)
+                yield line
+            if pos != start:
+                self._pos = pos
+                self._save_pos()
+                last = time.time()
+                continue
+            if timeout and time.time() - last >= timeout:
+                last = time.time()
+                yield None
+            time.sleep(RingManager.POLL_INTERVAL)
+            self._check_ring()
+
+
+class RingCollector(object):
+    # run tfrec with the handler and write its records to a ring file for
+    # the driver to read.  the collector runs on its own, so tfrec keeps
+    # running when weewx restarts.  tfrec is restarted if it stops.  stop
+    # only asks the collector to stop, so that it can be a signal handler;
+    # run shuts tfrec down within POLL_INTERVAL seconds.
+
+    RESTART_DELAY = 10
+    POLL_INTERVAL = 1
+
+    def __init__(self, filename, capacity=4096):
+        self._ring = RingBuffer(filename, capacity, writer=True)
+        self._mgr = None
+        self._running = False
+        loginf("ring '%s' with %d records, %d written" % (
+            filename, self._ring.capacity, self._ring.written))
+
+    def run(self, cmd, path=None, ld_library_path=None, handler=None):
+        cmds = cmd if isinstance(cmd, list) else [cmd]
+        cmds = [PacketFactory.get_handler_cmd(c, handler) for c in cmds]
+        self._running = True
+        try:
+            while self._running:
+                self._collect(cmds if len(cmds) > 1 else cmds[0],
+                              path, ld_library_path)
+                if self._running:
+                    loginf("tfrec stopped, restart in %s seconds" %
+                           RingCollector.RESTART_DELAY)
+                    restart = time.time() + RingCollector.RESTART_DELAY
+                    while self._running and time.time() < restart:
+                        time.sleep(RingCollector.POLL_INTERVAL)
+        finally:
+            self._ring.close()
+
+    def _collect(self, cmd, path, ld_library_path):
+        # run tfrec until it stops, or until the collector is stopped
+        self._mgr = ProcManager(pid_file=self._ring.filename + '.pid')
+        self._mgr.startup(cmd, path, ld_library_path)
+        try:
+            for line in self._mgr.get_lines(RingCollector.POLL_INTERVAL):
+                if not self._running:
+                    break
+                if line is not None and not self._ring.append(line.split()):
+                    logdbg("info: %s" % line)
+            for line in self._mgr.get_stderr():
+                logerr("err: %s" % line.rstrip())
+        finally:
+            self._mgr.shutdown()
+
+    def stop(self, signum=None, frame=None):
+        self._running = False
+
+
+# the observations in the temperature and humidity values of the sensor
+# types with subtypes, by sensor type and then by subtype, which is the last
+# character of the identifier.  each observation is (index, name, scale),
+# where index 0 is the temperature value and 1 is the humidity value.  speeds
+# are sent in m/s and are scaled to km/h, and WeatherHub rain counts of
+# 0.25 mm to cm, as weewx.METRIC expects.  the size of a TX22 rain count is
+# not known, so it is only available as a count.  a humidity of 0 means that
+# the sensor has no humidity.
+SUBTYPE_TABLE = {
+    'TFA': {
+        0x0: [(0, 'temperature', 1), (1, 'humidity', 1)],
+        0x1: [(0, 'temperature_ext', 1)]},
+    'TX22': {
+        0x0: [(0, 'temperature', 1), (1, 'humidity', 1)],
+        0x1: [(1, 'humidity', 1)],
+        0x2: [(0, 'rain_count', 1)],
+        0x3: [(0, 'wind_speed', 3.6), (1, 'wind_dir', 1)],
+        0x4: [(0, 'wind_gust', 3.6)]},
+    'WeatherHub': {
+        0x0: [(0, 'temperature', 1), (1, 'humidity', 1)],
+        0x1: [(0, 'temperature_ext', 1)],
+        0x2: [(0, 'rain_count', 1), (0, 'rain_total', 0.025),
+              (1, 'rain_age', 1)],
+        0x3: [(0, 'wind_speed', 3.6), (1, 'wind_dir', 1)],
+        0x4: [(0, 'wind_gust', 3.6)],
+        0x5: [(0, 'state', 1), (1, 'state_age', 1)],
+        0xc: [(0, 'temperature_1', 1), (1, 'humidity_1', 1)],
+        0xd: [(0, 'temperature_2', 1), (1, 'humidity_2', 1)],
+        0xe: [(0, 'temperature_3', 1), (1, 'humidity_3', 1)]},
+}
+
+
+class Reading(object):
+    # the observations of one sensor at one time, as parsed.  the values are
+    # keyed by plain observation name, with the sensor and packet type kept
+    # alongside, so nothing is qualified and split again on the way through
+    # the driver.  as_packet gives the qualified form for display.  a reading
+    # without values is false, like an empty packet.
+
+    __slots__ = ['packet_type', 'sensor_id', 'timestamp', 'units', 'values']
+
+    def __init__(self, packet_type, sensor_id, timestamp, values,
+                 units=weewx.METRIC):
+        self.packet_type = packet_type
+        self.sensor_id = sensor_id
+        self.timestamp = timestamp
+        self.units = units
+        self.values = values # observation -> value
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        return (isinstance(other, Reading) and
+                self.packet_type == other.packet_type and
+                self.sensor_id == other.sensor_id and
+                self.timestamp == other.timestamp and
+                self.units == other.units and self.values == other.values)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.as_packet())
+
+    def as_packet(self):
+        # observation.<sensor_id>.<packet_type>
+        suffix = '.%s.%s' % (self.sensor_id, self.packet_type)
+        packet = dict((n + suffix, v) for n, v in self.values.items())
+        packet['dateTime'] = self.timestamp
+        packet['usUnits'] = self.units
+        return packet
+
+    def merge(self, other):
+        # add the values of another reading of the same sensor
+        self.values.update(other.values)
+        if other.timestamp > self.timestamp:
+            self.timestamp = other.timestamp
+
+    def copy(self):
+        return Reading(self.packet_type, self.sensor_id, self.timestamp,
+                       dict(self.values), self.units)
 
 
 class Packet:
@@ -341,23 +1762,158 @@ class Packet:
     def __init__(self):
         pass
 
+    # bit in the tfrec -T mask that enables this sensor family
+    TYPE_MASK = 0
+
+    # the (length, prefix) of the sensor identifiers this parser handles.
+    # see PacketFactory.get_key.
+    ID_KEYS = []
+
+    # use the fixed layout of the -D output instead of a regular expression
+    # wherever a parser can.  the regular expressions are still used for any
+    # line that does not have the expected layout.
+    USE_FIELDS = True
+
+    # whether the sequence number in the handler records is meaningful.
+    # tfrec sets it to 0 for the sensors that do not send one.
+    HANDLER_SEQUENCE = False
+
+    # the observations of each subtype, from SUBTYPE_TABLE.  None for the
+    # sensor types without subtypes.
+    SUBTYPES = None
+
+    # the fields that every line of a transmission has.  the other fields
+    # of the lines of a transmission are all different.
+    BURST_FIELDS = ['dateTime', 'usUnits', 'hardware_id', 'sequence',
+                    'lowbat', 'rssi', 'offset']
+
     @staticmethod
-    def parse_text(ts, payload, lines):
+    def parse_text(payload, lines):
+        # parse the payload, which has been taken from the front of the
+        # lines.  a parser may take more lines from the front of the deque
+        # if a packet spans several lines.
         return None
 
     @staticmethod
-    def add_identifiers(pkt, sensor_id='', packet_type=''):
-        # qualify each field name with details about the sensor.  not every
-        # sensor has all three fields.
-        # observation.<sensor_id>.<packet_type>
-        packet = dict()
-        if 'dateTime' in pkt:
-            packet['dateTime'] = pkt.pop('dateTime', 0)
-        if 'usUnits' in pkt:
-            packet['usUnits'] = pkt.pop('usUnits', 0)
-        for n in pkt:
-            packet["%s.%s.%s" % (n, sensor_id, packet_type)] = pkt[n]
-        return packet
+    def parse_record(fields, parser):
+        # parse a record written by the tfrec -e handler:
+        #   <id> <temp> <hum> <seq> <batfail> <rssi> [<flags>] <timestamp>
+        # the record has no hexdump and no layout to guess, so one parser
+        # serves every sensor type.  return the packet without identifiers,
+        # or None if the fields are not a record of the parser.
+        if len(fields) not in [7, 8]:
+            return None
+        try:
+            pkt = Packet.decode(parser, fields[0],
+                                float(fields[1]), float(fields[2]))
+            if pkt is None:
+                return None
+            pkt['dateTime'] = int(fields[-1])
+            pkt['usUnits'] = weewx.METRIC
+            if parser.HANDLER_SEQUENCE:
+                pkt['sequence'] = int(fields[3])
+            pkt['lowbat'] = float(fields[4])
+            pkt['rssi'] = float(fields[5])
+        except ValueError:
+            return None
+        return pkt
+
+    @staticmethod
+    def decode(parser, sensor_id, temp, hum):
+        # put the temperature and humidity values into a packet, as the
+        # observations of the subtype in the last character of the
+        # identifier.  the hardware_id is the identifier without the
+        # subtype.  return None for an unknown subtype.
+        if parser.SUBTYPES is None:
+            pkt = {'hardware_id': sensor_id, 'temperature': temp}
+            if hum != 0:
+                pkt['humidity'] = hum
+            return pkt
+        observations = parser.SUBTYPES.get(int(sensor_id[-1], 16))
+        if observations is None:
+            logdbg("unknown subtype: %s" % sensor_id)
+            return None
+        pkt = {'hardware_id': sensor_id[:-1]}
+        values = (temp, hum)
+        for idx, name, scale in observations:
+            if name.startswith('humidity') and values[idx] == 0:
+                continue
+            pkt[name] = values[idx] * scale
+        return pkt
+
+    @staticmethod
+    def merge_burst(pkt, lines, parse):
+        # merge the lines at the front of the deque that are from the same
+        # transmission as the packet: the same sensor at the same time, with
+        # different observations.  parse returns the packet without
+        # identifiers of a line, or None.
+        while lines:
+            nxt = parse(lines[0].strip())
+            if (nxt is None or nxt['hardware_id'] != pkt['hardware_id'] or
+                nxt['dateTime'] != pkt['dateTime'] or
+                any(k in pkt for k in nxt if k not in Packet.BURST_FIELDS)):
+                break
+            lines.popleft()
+            pkt.update(nxt)
+        return pkt
+
+    @staticmethod
+    def parse_subtypes(parser, payload, lines):
+        # parse a line of -D output from a sensor type with subtypes, with
+        # the lines after it from the same transmission, into one packet
+        parse = lambda p: Packet.parse_id_line(parser, p)
+        pkt = parse(payload)
+        if pkt is None:
+            loginf("%s: unrecognized data: %s" % (parser.__name__, payload))
+            return None
+        pkt = Packet.merge_burst(pkt, lines, parse)
+        return TFA.insert_ids(pkt, parser.__name__)
+
+    @staticmethod
+    def parse_id_line(parser, payload):
+        # ID 20009900 +17.2 47 12 12 RSSI 83 Offset 11kHz
+        # the meaning of the two numbers after the humidity is not known
+        fields = None
+        if Packet.USE_FIELDS:
+            ts, fields = Packet.split_fields(payload)
+            if (fields is None or len(fields) != 9 or fields[5] != 'RSSI' or
+                fields[7] != 'Offset' or fields[8][-3:] != 'kHz' or
+                (len(fields[0]), fields[0][:1]) not in parser.ID_KEYS):
+                fields = None
+        if fields is None:
+            m = parser.PATTERN.search(payload)
+            if not m:
+                return None
+            ts = m.group(1)
+            fields = m.group(2, 3, 4) + ('', '', 'RSSI', m.group(5),
+                                          'Offset', m.group(6) + 'kHz')
+        try:
+            pkt = Packet.decode(parser, fields[0],
+                                float(fields[1]), float(fields[2]))
+            if pkt is None:
+                return None
+            pkt['dateTime'] = int(ts)
+            pkt['usUnits'] = weewx.METRIC
+            pkt['rssi'] = float(fields[6])
+            pkt['offset'] = float(fields[8][:-3])
+        except ValueError:
+            return None
+        return pkt
+
+    @staticmethod
+    def split_fields(payload):
+        # split a line of -D output on whitespace and return the timestamp
+        # and the fields after the ID marker.  the layout is:
+        #   #<count> <timestamp>  <hexdump> ID <id> <values>
+        # return (None, None) if the line does not have that layout.
+        fields = payload.split()
+        try:
+            idx = fields.index('ID')
+            if fields[0][0] == '#':
+                return int(fields[1]), fields[idx + 1:]
+        except (ValueError, IndexError):
+            pass
+        return None, None
 
 
 class TFA(object):
@@ -365,35 +1921,70 @@ class TFA(object):
     def insert_ids(pkt, pkt_type):
         # there should be a sensor_id field in the packet to identify sensor.
         # ensure the sensor_id is upper-case - it should be 4 hex characters.
+        # the rest of the packet is the values of the reading.
         sensor_id = str(pkt.pop('hardware_id', '0000')).upper()
-        return Packet.add_identifiers(pkt, sensor_id, pkt_type)
+        ts = pkt.pop('dateTime', None)
+        units = pkt.pop('usUnits', weewx.METRIC)
+        return Reading(pkt_type, sensor_id, ts, pkt, units)
 
 
 class TFA_1Packet(Packet):
 
-    IDENTIFIER = " seq "
+    TYPE_MASK = 0x01
+    ID_KEYS = [(4, '')]
+    HANDLER_SEQUENCE = True
     PATTERN = re.compile('^#\d+ ([\d]+)  .+ID ([0-9a-f]{4}) ([\d.\+-]+) ([\d]+)% seq ([0-9a-fA-F]+) lowbat ([\d]+) RSSI ([\d]+)')
 
     @staticmethod
     def parse_text(payload, lines):
+        pkt = None
+        if Packet.USE_FIELDS:
+            pkt = TFA_1Packet.parse_fields(payload)
+        if pkt is None:
+            pkt = TFA_1Packet.parse_regex(payload)
+        return pkt
+
+    @staticmethod
+    def parse_fields(payload):
+        # ID 65b0 +22.0 35% seq e lowbat 0 RSSI 81
+        ts, fields = Packet.split_fields(payload)
+        if (fields is None or len(fields) != 9 or fields[3] != 'seq' or
+            fields[5] != 'lowbat' or fields[7] != 'RSSI' or
+            fields[2][-1:] != '%'):
+            return None
         pkt = dict()
-        m = TFA_1Packet.PATTERN.search(lines[0])
+        try:
+            pkt['dateTime'] = ts
+            pkt['usUnits'] = weewx.METRIC
+            pkt['hardware_id'] = fields[0]
+            pkt['temperature'] = float(fields[1])
+            if fields[2] != '0%':
+                pkt['humidity'] = float(fields[2][:-1])
+            pkt['sequence'] = int(fields[4], 16)
+            pkt['lowbat'] = float(fields[6])
+            pkt['rssi'] = float(fields[8])
+        except ValueError:
+            return None
+        return TFA.insert_ids(pkt, TFA_1Packet.__name__)
+
+    @staticmethod
+    def parse_regex(payload):
+        m = TFA_1Packet.PATTERN.search(payload)
         if m:
-            logdbg("tfa1: %s" % lines[0])
+            logdbg("tfa1: %s" % payload)
+            pkt = dict()
             pkt['dateTime'] = int(m.group(1))
             pkt['usUnits'] = weewx.METRIC
             pkt['hardware_id'] = m.group(2)
             pkt['temperature'] = float(m.group(3))
             if m.group(4) != '0':
                 pkt['humidity'] = float(m.group(4))
-            ###pkt['sequence'] = m.group(5)
+            pkt['sequence'] = int(m.group(5), 16)
             pkt['lowbat'] = float(m.group(6))
             pkt['rssi'] = float(m.group(7))
-            pkt = TFA.insert_ids(pkt, TFA_1Packet.__name__)
-        else:
-            loginf("tfa1: unrecognized data: %s" % lines[0])
-        lines.pop(0)
-        return pkt
+            return TFA.insert_ids(pkt, TFA_1Packet.__name__)
+        loginf("tfa1: unrecognized data: %s" % payload)
+        return None
 
     # format with -D option:
     # #1234 1485215350  2d d4 65 b0 86 20 23 60 e0 56 97           ID 65b0 +22.0 35% seq e lowbat 0 RSSI 81
@@ -406,22 +1997,15 @@ class TFA_1Packet(Packet):
 
 class TFA_2Packet(Packet):
     # NOT TESTED !!!
-    IDENTIFIER = "ID 1000"
-    PATTERN = re.compile('^#\d+ ([\d]+)  .+ID 1000([09])([0-9a-f]{2})([0-4]) ([\d.-]+) ([\d]+) ([\d]+) ([\d]+) RSSI ([\d]+) Offset ([\d]+)kHz')
+    TYPE_MASK = 0x02
+    ID_KEYS = [(8, '1')]
+    SUBTYPES = SUBTYPE_TABLE['TFA']
+    PATTERN = re.compile('^#\d+ ([\d]+)  .+ID (1000[09][0-9a-f]{2}[0-4]) ([\d.\+-]+) ([\d]+) [\d]+ [\d]+ RSSI ([\d]+) Offset (-?[\d]+)kHz')
 
     @staticmethod
     def parse_text(payload, lines):
-        pkt = dict()
-        m = TFA_2Packet.PATTERN.search(lines[0])
-        if m:
-            logdbg("tfa2: %s" % lines[0])
-            pkt = TFA.insert_ids(pkt, TFA_2Packet.__name__)
-        else:
-            loginf("tfa2: unrecognized data: %s" % lines[0])
-        lines.pop(0)
-        return pkt
+        return Packet.parse_subtypes(TFA_2Packet, payload, lines)
 
-    # WARNING: Parsing not implemented !
     # format with -D option:
     # #1234 1485215350  2d d4 65 b0 86 20 23 60 e0 56 97           ID 20009900 +17.2 47 12 12 RSSI 83 Offset 11kHz
     # These sensors do not have a unique ID. Each time the battery is inserted, a random ID is 
@@ -461,66 +2045,70 @@ class TFA_2Packet(Packet):
 
 class TFA_3Packet(Packet):
     # NOT TESTED !!!
-    IDENTIFIER = "ID 2000"
-    PATTERN = re.compile('^#\d+ ([\d]+)  .+ID 2000([09])([0-9a-f]{2})([0-4]) ([\d.-]+) ([\d]+) ([\d]+) ([\d]+) RSSI ([\d]+) Offset ([\d]+)kHz')
+    TYPE_MASK = 0x04
+    ID_KEYS = [(8, '2')]
+    SUBTYPES = SUBTYPE_TABLE['TFA']
+    PATTERN = re.compile('^#\d+ ([\d]+)  .+ID (2000[09][0-9a-f]{2}[0-4]) ([\d.\+-]+) ([\d]+) [\d]+ [\d]+ RSSI ([\d]+) Offset (-?[\d]+)kHz')
 
     @staticmethod
     def parse_text(payload, lines):
-        pkt = dict()
-        m = TFA_3Packet.PATTERN.search(lines[0])
-        if m:
-            logdbg("tfa3: %s" % lines[0])
-            pkt = TFA.insert_ids(pkt, TFA_3Packet.__name__)
-        else:
-            loginf("tfa3: unrecognized data: %s" % lines[0])
-        lines.pop(0)
-        return pkt
+        return Packet.parse_subtypes(TFA_3Packet, payload, lines)
 
-    # WARNING: Parsing not implemented !
     # format
     # See: TFA_2Packet
 
 
 class TX22Packet(Packet):
     # NOT TESTED !!!
-    IDENTIFIER = "ID3000"
-    PATTERN = re.compile('^#\d+ ([\d]+)  .+ID 3000([09])([0-9a-f]{2})([0-4]) ([\d.-]+) ([\d]+) ([\d]+) ([\d]+) RSSI ([\d]+) Offset ([\d]+)kHz')
+    TYPE_MASK = 0x08
+    ID_KEYS = [(8, '3')]
+    SUBTYPES = SUBTYPE_TABLE['TX22']
+    PATTERN = re.compile('^#\d+ ([\d]+)  .+ID (3000[09][0-9a-f]{2}[0-4]) ([\d.\+-]+) ([\d]+) [\d]+ [\d]+ RSSI ([\d]+) Offset (-?[\d]+)kHz')
 
     @staticmethod
-    def parse_text(ts, payload, lines):
-        pkt = dict()
-        m = TX22Packet.PATTERN.search(lines[0])
-        if m:
-            logdbg("tx22: %s" % lines[0])
-            pkt = TFA.insert_ids(pkt, TX22Packet.__name__)
-        else:
-            loginf("tx22: unrecognized data: %s" % lines[0])
-        lines.pop(0)
-        return pkt
+    def parse_text(payload, lines):
+        return Packet.parse_subtypes(TX22Packet, payload, lines)
 
-    # WARNING: Parsing not implemented !
     # format
     # See: TFA_2Packet
 
 
 class WeatherHubPacket(Packet):
     # NOT TESTED !!!
-    IDENTIFIER = " {10}"  # no unique identifiere found
-    PATTERN = re.compile('^#\d+ ([\d]+)  .+([0-9a-f]{12})([1-5c-e]) ([\d.-]+) ([\d]+) ([\d]+) ([\d]+) ([\d]+) ([\d]+)')
+    TYPE_MASK = 0x20
+    ID_KEYS = [(13, '')]  # no ID marker, just a 13 character identifier
+    HANDLER_SEQUENCE = True
+    SUBTYPES = SUBTYPE_TABLE['WeatherHub']
+    PATTERN = re.compile('^#\d+ [\d]+  .+ ([0-9a-f]{12}[0-5c-e] [\d.\+-]+ [\d]+ [\d]+ [\d]+ [\d]+ [\d]+ [\d]+)$')
 
     @staticmethod
     def parse_text(payload, lines):
-        pkt = dict()
-        m = WeatherHubPacket.PATTERN.search(lines[0])
-        if m:
-            logdbg("whub: %s" % lines[0])
-            pkt = TFA.insert_ids(pkt, WeatherHubPacket.__name__)
-        else:
-            loginf("whub: unrecognized data: %s" % lines[0])
-        lines.pop(0)
-        return pkt
+        parse = WeatherHubPacket.parse_line
+        pkt = parse(payload)
+        if pkt is None:
+            loginf("whub: unrecognized data: %s" % payload)
+            return None
+        pkt = Packet.merge_burst(pkt, lines, parse)
+        return TFA.insert_ids(pkt, WeatherHubPacket.__name__)
+
+    @staticmethod
+    def parse_line(payload):
+        # after the hexdump, the line is a handler record
+        record = None
+        if Packet.USE_FIELDS:
+            fields = payload.split()
+            if fields and fields[0][:1] == '#':
+                for i in range(2, len(fields)):
+                    if len(fields[i]) == 13:
+                        record = fields[i:]
+                        break
+        if record is None:
+            m = WeatherHubPacket.PATTERN.search(payload)
+            if not m:
+                return None
+            record = m.group(1).split()
+        return Packet.parse_record(record, WeatherHubPacket)
 
-    # WARNING: Parsing not implemented !
     # format with -D option: WARNING: format below is a guess
     # #1234 1525996300  2d d4 65 b0 86 20 23 60 e0 56 97        0b3d9ddeeabc3 +0.7 270 950 0 92 0 1525996300
     # These sensors have unique 6 byte IDs, usually printed on sensor. The first byte describes 
@@ -563,6 +2151,31 @@ class WeatherHubPacket(Packet):
     #
     # Some sensors (rain, wind, door) send a history of previous values. This history is 
     # currently just internally decoded but not used. You can see if with the "-DD" option.
+    #
+    # format with -DD option: WARNING: format below is a guess, and has not been
+    # checked against a real tfrec.  The history follows the telegram, one value per
+    # line, with the number of intervals ago and the time of the value:
+    #  history 0833c2708abc2 3 +8.0 1230 1525997614
+
+    HISTORY_MARKER = 'history'
+
+    @staticmethod
+    def parse_history(payload):
+        # return the packet of a history line, or None
+        fields = payload.split()
+        if (len(fields) != 6 or fields[0] != WeatherHubPacket.HISTORY_MARKER or
+            len(fields[1]) != 13):
+            return None
+        try:
+            pkt = Packet.decode(WeatherHubPacket, fields[1],
+                                float(fields[3]), float(fields[4]))
+            if pkt is None:
+                return None
+            pkt['dateTime'] = int(fields[5])
+            pkt['usUnits'] = weewx.METRIC
+        except ValueError:
+            return None
+        return TFA.insert_ids(pkt, WeatherHubPacket.__name__)
 
 
 class PacketFactory(object):
@@ -576,30 +2189,926 @@ class PacketFactory(object):
         WeatherHubPacket
     ]
 
+    # the sensor types that tfrec enables when no -T option is specified
+    DEFAULT_TYPE_MASK = 0x07
+
+    # parsers for the enabled sensor types, indexed by identifier key
+    _dispatch = None
+
+    @staticmethod
+    def get_type_mask(cmd):
+        # get the sensor types enabled by the -T option of the tfrec command
+        args = cmd.split()
+        for i, arg in enumerate(args):
+            value = None
+            if arg == '-T' and i + 1 < len(args):
+                value = args[i + 1]
+            elif arg.startswith('-T') and len(arg) > 2:
+                value = arg[2:]
+            if value is not None:
+                try:
+                    return int(value, 16)
+                except ValueError:
+                    logerr("bad sensor type mask '%s' in '%s'" % (value, cmd))
+        return PacketFactory.DEFAULT_TYPE_MASK
+
     @staticmethod
-    def create(lines):
-        # return a list of packets from the specified lines
+    def configure(mask=DEFAULT_TYPE_MASK):
+        # enable the parsers for the sensor types in the mask.  lines from
+        # other sensor types are ignored without being parsed.
+        dispatch = dict()
+        for parser in PacketFactory.KNOWN_PACKETS:
+            if parser.TYPE_MASK & mask:
+                for key in parser.ID_KEYS:
+                    dispatch[key] = parser
+        PacketFactory._dispatch = dispatch
+        logdbg("enabled parsers: %s" % sorted(
+            set(p.__name__ for p in dispatch.values())))
+
+    @staticmethod
+    def get_key(payload, whb_enabled=True):
+        # find the sensor identifier in a line of tfrec -D output and return
+        # the (length, prefix) key used to pick a parser.  the prefix is only
+        # significant for the 8 character identifiers of the TFA_2, TFA_3 and
+        # TX22 types, where the first character is the type.
+        idx = payload.find(' ID ')
+        if idx >= 0:
+            fields = payload[idx + 4:].split(None, 1)
+            if not fields:
+                return None
+            sensor_id = fields[0]
+            if len(sensor_id) == 8:
+                return (8, sensor_id[0])
+            return (len(sensor_id), '')
+        if whb_enabled and payload.startswith('#'):
+            # WeatherHub lines have no ID marker
+            for field in payload.split()[2:]:
+                if len(field) == 13:
+                    return (13, '')
+        return None
+
+    @staticmethod
+    def get_handler_cmd(cmd, handler=None):
+        # turn a tfrec command into one that quietly runs the handler for
+        # each telegram, instead of printing the -D debug output.  the
+        # handler writes the records to the stdout of tfrec.
+        args = [a for a in cmd.split()
+                if not (a.startswith('-D') and a.strip('-D') == '')]
+        for flag in ['-q', '-e']:
+            if flag in args:
+                idx = args.index(flag)
+                del args[idx:idx + (2 if flag == '-e' else 1)]
+        args.extend(['-q', '-e', handler or DEFAULT_HANDLER])
+        return ' '.join(args)
+
+    @staticmethod
+    def get_record_key(sensor_id):
+        # the (length, prefix) key of the identifier in a handler record
+        if len(sensor_id) == 8:
+            return (8, sensor_id[0])
+        return (len(sensor_id), '')
+
+    @staticmethod
+    def create(lines, single=False, stats=None, history=None):
+        # return a list of packets from the specified lines.  the lines are
+        # consumed from the front of a deque.  with single, only the first
+        # line is parsed, with any lines after it from the same transmission.
+        # the lines are counted in the DriverStats of the driver, if any, and
+        # history lines are kept in its HistoryStore, if any.
+        if not isinstance(lines, deque):
+            lines = deque(lines)
         while lines:
-            pkt = PacketFactory.parse_text(lines)
+            pkt = PacketFactory.parse_text(lines, stats, history)
             if pkt is not None:
                 yield pkt
+            if single:
+                break
 
     @staticmethod
-    def parse_text(lines):
-        pkt = dict()
-        payload = lines[0].strip()
+    def parse_text(lines, stats=None, history=None):
+        dispatch = PacketFactory._dispatch
+        if dispatch is None:
+            PacketFactory.configure()
+            dispatch = PacketFactory._dispatch
+        line = lines.popleft()
+        payload = line.strip()
+        if payload.startswith(WeatherHubPacket.HISTORY_MARKER):
+            # previous values, which are not passed on as packets
+            if (history is not None and
+                WeatherHubPacket.ID_KEYS[0] in dispatch):
+                pkt = WeatherHubPacket.parse_history(payload)
+                if pkt is not None:
+                    history.add(pkt)
+                if stats is not None:
+                    stats.count('unrecognized.history'
+                                if pkt is None else 'history')
+            return None
+        if payload and payload[0] != '#' and ' ID ' not in payload:
+            # a record from the tfrec -e handler
+            fields = payload.split()
+            parser = dispatch.get(PacketFactory.get_record_key(fields[0]))
+            pkt = None
+            if parser is not None:
+                pkt = Packet.parse_record(fields, parser)
+            if pkt is not None:
+                pkt = Packet.merge_burst(
+                    pkt, lines,
+                    lambda p: Packet.parse_record(p.split(), parser))
+                pkt = TFA.insert_ids(pkt, parser.__name__)
+            if stats is not None:
+                stats.count('%s.%s' % (
+                    'unrecognized' if pkt is None else 'parsed',
+                    parser.__name__ if parser else 'record'))
+            if pkt is None:
+                logdbg("info: %s" % payload)
+            return pkt
         if payload:
-            for parser in PacketFactory.KNOWN_PACKETS:
-                if payload.find(parser.IDENTIFIER) >= 0:
-                    pkt = parser.parse_text(payload, lines)
-                    return pkt
+            key = PacketFactory.get_key(
+                payload, WeatherHubPacket.ID_KEYS[0] in dispatch)
+            parser = dispatch.get(key)
+            if parser is not None:
+                pkt = parser.parse_text(payload, lines)
+                if stats is not None:
+                    stats.count('%s.%s' % (
+                        'unrecognized' if pkt is None else 'parsed',
+                        parser.__name__))
+                return pkt
+            if stats is not None:
+                stats.count('unrecognized')
             logdbg("info: %s" % payload)
         else:
-            logdbg("parse_text failed: lines=%s" % lines)
-        lines.pop(0)
+            logdbg("parse_text failed: line=%s" % line)
         return None
 
 
+class SensorMap(object):
+    # the compiled form of the sensor_map stanza.  each map element is split
+    # once into its <observation_name>.<sensor_id>.<packet_type> parts, and
+    # parts with glob characters are compiled to regular expressions.  exact
+    # elements are indexed by the (observation, sensor_id, packet_type) tuple.
+    #
+    # the fields matching each observation are resolved the first time a
+    # (sensor_id, packet_type) pair is seen, then kept in a least recently
+    # used cache of cache_size sensors, so that packets from known sensors
+    # are mapped with plain dict lookups.
+
+    GLOB_CHARS = re.compile(r'[*?\[]')
+    CACHE_SIZE = 256
+
+    def __init__(self, sensor_map=None, cache_size=CACHE_SIZE):
+        self._sensor_map = dict(sensor_map or {})
+        self._exact = dict() # (obs, sensor_id, packet_type) -> [field, ...]
+        self._globs = [] # [(field, obs, sensor_id, packet_type), ...]
+        self._bare = dict() # unqualified observation -> [field, ...]
+        self._cache = OrderedDict() # (sensor_id, packet_type) -> {obs: fields}
+        self._cache_size = cache_size
+        self._move_to_end = getattr(self._cache, 'move_to_end', None)
+        for n in self._sensor_map:
+            pattern = self._sensor_map[n]
+            pparts = pattern.split('.')
+            if len(pparts) != 3:
+                self._bare.setdefault(pattern, []).append(n)
+                continue
+            self._bare.setdefault(pparts[0], []).append(n)
+            matchers = [SensorMap._compile(p) for p in pparts]
+            if all(isinstance(m, str) for m in matchers):
+                self._exact.setdefault(tuple(pparts), []).append(n)
+            else:
+                self._globs.append((n, matchers[0], matchers[1], matchers[2]))
+
+    def __len__(self):
+        return len(self._sensor_map)
+
+    def __repr__(self):
+        return repr(self._sensor_map)
+
+    def __iter__(self):
+        return iter(self._sensor_map)
+
+    def get_observation(self, field):
+        # the observation name that the field is mapped from, or None
+        pattern = self._sensor_map.get(field)
+        return pattern.split('.')[0] if pattern else None
+
+    @staticmethod
+    def _compile(part):
+        # use glob matching for parts of the tuple
+        if SensorMap.GLOB_CHARS.search(part):
+            return re.compile(fnmatch.translate(part)).match
+        return part
+
+    @staticmethod
+    def _part_match(matcher, value):
+        if isinstance(matcher, str):
+            return matcher == value
+        return matcher(value) is not None
+
+    def _get_resolved(self, sensor_id, packet_type):
+        # the cached fields of each observation of the specified sensor
+        key = (sensor_id, packet_type)
+        resolved = self._cache.get(key)
+        if resolved is None:
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+            resolved = self._cache[key] = dict()
+        elif self._move_to_end is not None:
+            self._move_to_end(key)
+        else:
+            self._cache[key] = self._cache.pop(key) # python 2
+        return resolved
+
+    def lookup(self, obs, sensor_id, packet_type):
+        # return the fields that an observation from the specified sensor
+        # maps to.  this is an empty tuple for unmapped observations.
+        resolved = self._get_resolved(sensor_id, packet_type)
+        fields = resolved.get(obs)
+        if fields is None:
+            fields = resolved[obs] = self._resolve(obs, sensor_id, packet_type)
+        return fields
+
+    def _resolve(self, obs, sensor_id, packet_type):
+        fields = list(self._exact.get((obs, sensor_id, packet_type), []))
+        for (n, obs_m, id_m, type_m) in self._globs:
+            if (SensorMap._part_match(obs_m, obs) and
+                SensorMap._part_match(id_m, sensor_id) and
+                SensorMap._part_match(type_m, packet_type)):
+                fields.append(n)
+        return tuple(fields)
+
+    def map_packet(self, pkt):
+        # when several keys in the packet match a map element, the first one
+        # wins.
+        if isinstance(pkt, Reading):
+            return self.map_reading(pkt)
+        packet = dict()
+        for k in pkt:
+            if k == 'dateTime' or k == 'usUnits':
+                continue
+            parts = k.split('.')
+            if len(parts) == 3:
+                fields = self.lookup(parts[0], parts[1], parts[2])
+            else:
+                fields = self._bare.get(k, ())
+            for n in fields:
+                if n not in packet:
+                    packet[n] = pkt[k]
+        return packet
+
+    def map_reading(self, reading):
+        # map the values of a reading, without qualifying their names
+        packet = dict()
+        sensor_id = reading.sensor_id
+        packet_type = reading.packet_type
+        resolved = self._get_resolved(sensor_id, packet_type)
+        for obs, value in reading.values.items():
+            fields = resolved.get(obs)
+            if fields is None:
+                fields = resolved[obs] = self._resolve(
+                    obs, sensor_id, packet_type)
+            for n in fields:
+                if n not in packet:
+                    packet[n] = value
+        return packet
+
+
+class DuplicateFilter(object):
+    # sensors repeat their telegrams, and with several sensors on the air the
+    # repeats are not always sequential.  a packet is a duplicate when one
+    # with the same packet type, sensor, sequence number and timestamp was
+    # seen within the last window seconds.  packets without a sequence
+    # number are never treated as duplicates here.
+
+    MAX_SIZE = 1024
+
+    def __init__(self, window=30, max_size=MAX_SIZE):
+        self._window = window
+        self._max_size = max_size
+        self._seen = OrderedDict() # key -> time first seen, oldest first
+
+    def is_duplicate(self, pkt):
+        seq = pkt.values.get('sequence')
+        if seq is None:
+            return False
+        now = time.time()
+        seen = self._seen
+        while seen:
+            key, first_seen = next(iter(seen.items()))
+            if now - first_seen < self._window:
+                break
+            del seen[key]
+        key = (pkt.packet_type, pkt.sensor_id, seq, pkt.timestamp)
+        if key in seen:
+            return True
+        if len(seen) >= self._max_size:
+            seen.popitem(last=False)
+        seen[key] = now
+        return False
+
+
+class ReceiverMerger(object):
+    # merge the packets from several receivers, which often receive the same
+    # telegram.  each packet is held for window seconds.  if the same
+    # telegram arrives from another receiver in that time, only the packet
+    # with the best rssi is kept.  telegrams are identified by sensor and
+    # sequence number, or by sensor and timestamp if there is no sequence
+    # number.  released packets are ordered by timestamp, each with the line
+    # that it was parsed from.
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self._held = OrderedDict() # key -> [arrival, packet, rssi, line]
+        self.merged = 0
+
+    def merge(self, packets, now=None, line=None):
+        # add the packets parsed from a line, and return the (packet, line)
+        # pairs that are due for release
+        now = now or time.time()
+        released = []
+        for pkt in packets:
+            seq = pkt.values.get('sequence')
+            key = (pkt.sensor_id, pkt.packet_type,
+                   pkt.timestamp if seq is None else seq)
+            rssi = pkt.values.get('rssi')
+            held = self._held.get(key)
+            if held is None:
+                self._held[key] = [now, pkt, rssi, line]
+            else:
+                self.merged += 1
+                if rssi is not None and (held[2] is None or rssi > held[2]):
+                    held[1:] = [pkt, rssi, line]
+        while self._held:
+            key, held = next(iter(self._held.items()))
+            if now - held[0] < self.window:
+                break
+            del self._held[key]
+            released.append((held[1], held[3]))
+        released.sort(key=lambda r: r[0].timestamp if r[0] else 0)
+        return released
+
+    def flush(self):
+        released = [(held[1], held[3]) for held in self._held.values()]
+        self._held.clear()
+        released.sort(key=lambda r: r[0].timestamp if r[0] else 0)
+        return released
+
+
+class PacketCoalescer(object):
+    # merge the mapped packets received within window seconds into a single
+    # loop packet, so that weewx handles fewer packets with more fields each.
+    # the merged packet is passed on early if one of its fields would be
+    # overwritten.  it has the timestamp of the latest packet in it.
+
+    def __init__(self, window=10):
+        self.window = window
+        self._packet = None
+        self._start = None
+        self.merged = 0
+
+    def add(self, pkt, now=None):
+        # add a packet, and return the packets that are ready
+        now = now or time.time()
+        released = []
+        if self._packet is not None:
+            if (now - self._start >= self.window or
+                pkt.get('usUnits') != self._packet.get('usUnits') or
+                any(k in self._packet for k in pkt
+                    if k not in ['dateTime', 'usUnits'])):
+                released.append(self._packet)
+                self._packet = None
+        if self._packet is None:
+            self._packet = dict(pkt)
+            self._start = now
+        else:
+            ts = max(self._packet['dateTime'], pkt['dateTime'])
+            self._packet.update(pkt)
+            self._packet['dateTime'] = ts
+            self.merged += 1
+        return released
+
+    def flush(self):
+        # return the packet being merged, if any
+        pkt = self._packet
+        self._packet = None
+        return pkt
+
+
+class SensorReception(object):
+    # reception quality of one sensor.  the sequence number counts from 0 to
+    # f, so the gap between the sequence numbers of consecutive telegrams
+    # tells how many telegrams were sent.  loss is calculated over the gaps
+    # of the last window telegrams, and the rssi histogram over the rssi of
+    # the last window telegrams.  the offset is the last frequency offset in
+    # kHz, for the sensor types that tfrec prints it for.  a telegram with
+    # the same sequence number as the one before is a repeat, and is only
+    # counted as such.
+
+    RSSI_MIN = 40 # lower edge of the first histogram bin
+    RSSI_BIN = 5 # width of each histogram bin
+    RSSI_BINS = 12
+
+    def __init__(self, window=64):
+        self.first_seen = None
+        self.last_seen = None
+        self.received = 0
+        self.expected = 0
+        self.gap_runs = 0
+        self.longest_gap = 0
+        self.last_seq = None
+        self.rssi_min = None
+        self.rssi_max = None
+        self.rssi_sum = 0.0
+        self.rssi_count = 0
+        self.rssi_hist = [0] * SensorReception.RSSI_BINS
+        self.offset = None
+        self.repeats = 0
+        self._window = window
+        self._gaps = deque()
+        self._gap_sum = 0
+        self._rssi_bins = deque()
+
+    def add(self, seq=None, rssi=None, now=None, offset=None):
+        now = now or time.time()
+        if self.first_seen is None:
+            self.first_seen = now
+        self.last_seen = now
+        if seq is not None and seq == self.last_seq:
+            self.repeats += 1
+            return
+        self.received += 1
+        gap = 1
+        if seq is not None:
+            if self.last_seq is not None:
+                gap = (seq - self.last_seq) % 16 or 16
+                if gap > 1:
+                    self.gap_runs += 1
+                    self.longest_gap = max(self.longest_gap, gap - 1)
+            self.last_seq = seq
+        self.expected += gap
+        self._gaps.append(gap)
+        self._gap_sum += gap
+        if len(self._gaps) > self._window:
+            self._gap_sum -= self._gaps.popleft()
+        if rssi is not None:
+            self.rssi_min = rssi if self.rssi_min is None else min(
+                self.rssi_min, rssi)
+            self.rssi_max = rssi if self.rssi_max is None else max(
+                self.rssi_max, rssi)
+            self.rssi_sum += rssi
+            self.rssi_count += 1
+            idx = int((rssi - SensorReception.RSSI_MIN) //
+                      SensorReception.RSSI_BIN)
+            idx = min(max(idx, 0), SensorReception.RSSI_BINS - 1)
+            self.rssi_hist[idx] += 1
+            self._rssi_bins.append(idx)
+            if len(self._rssi_bins) > self._window:
+                self.rssi_hist[self._rssi_bins.popleft()] -= 1
+        if offset is not None:
+            self.offset = offset
+
+    @property
+    def loss(self):
+        # percentage of telegrams lost over the window
+        if not self._gap_sum:
+            return None
+        return 100.0 * (self._gap_sum - len(self._gaps)) / self._gap_sum
+
+    @property
+    def rssi_mean(self):
+        if not self.rssi_count:
+            return None
+        return self.rssi_sum / self.rssi_count
+
+    @property
+    def gap_ratio(self):
+        # fraction of the telegrams lost since the sensor was first seen, or
+        # None for a sensor without sequence numbers
+        if self.last_seq is None or not self.expected:
+            return None
+        return float(self.expected - self.received) / self.expected
+
+    def rate(self, now=None):
+        # telegrams per minute since the sensor was first seen
+        elapsed = (now or time.time()) - self.first_seen
+        if elapsed <= 0:
+            return None
+        return 60.0 * self.received / elapsed
+
+
+class ReceptionStats(object):
+    # keep track of the reception quality of each sensor, and optionally add
+    # the loss of each sensor to its packets as the observation 'loss'.
+    # only the sensors with sequence numbers are tracked, unless all_sensors
+    # is set.
+
+    def __init__(self, loss_fields=False, window=64, all_sensors=False):
+        self._loss_fields = loss_fields
+        self._window = window
+        self._all_sensors = all_sensors
+        self.sensors = dict() # (sensor_id, packet_type) -> SensorReception
+        self.unrecognized = 0 # lines that gave no packet
+
+    def add_lines(self, lines, now=None):
+        # parse the line at the front of the deque, with the lines after it
+        # from the same transmission, and add its packets.  a line that gives
+        # no packet with observations is counted as unrecognized.
+        line = lines[0]
+        packets = [p for p in PacketFactory.create(lines, True) if p]
+        for p in packets:
+            self.add(p, now)
+        if not packets and line.strip():
+            self.unrecognized += 1
+
+    def add(self, pkt, now=None):
+        values = pkt.values
+        sequence = values.get('sequence')
+        if sequence is None and not self._all_sensors:
+            return
+        key = (pkt.sensor_id, pkt.packet_type)
+        reception = self.sensors.get(key)
+        if reception is None:
+            reception = self.sensors[key] = SensorReception(self._window)
+        reception.add(sequence, values.get('rssi'), now, values.get('offset'))
+        if sequence is None:
+            return
+        if self._loss_fields:
+            values['loss'] = reception.loss
+
+    def log_summary(self):
+        for key in sorted(self.sensors):
+            r = self.sensors[key]
+            loginf("reception %s.%s: received %d of %d, loss %.1f%%,"
+                   " %d gaps (longest %d), rssi %s/%s/%s, histogram %s" % (
+                       key[0], key[1], r.received, r.expected, r.loss or 0,
+                       r.gap_runs, r.longest_gap, r.rssi_min,
+                       None if r.rssi_mean is None else int(r.rssi_mean),
+                       r.rssi_max, ' '.join(str(x) for x in r.rssi_hist)))
+
+    def format_table(self, now=None):
+        # one line per sensor, by family then identifier, for the survey
+        now = now or time.time()
+        fmt = '%-10s %-13s %7s %6s %4s %4s %4s %6s %6s'
+        lines = [fmt % ('family', 'id', 'pkt/min', 'last', 'rssi', 'mean',
+                        'max', 'gaps', 'offset')]
+        na = lambda v, f: '-' if v is None else f % v
+        for key in sorted(self.sensors, key=lambda k: (k[1], k[0])):
+            r = self.sensors[key]
+            lines.append(fmt % (
+                key[1].replace('Packet', ''), key[0],
+                na(r.rate(now), '%.1f'),
+                '%ds' % (now - r.last_seen),
+                na(r.rssi_min, '%d'), na(r.rssi_mean, '%d'),
+                na(r.rssi_max, '%d'),
+                na(r.gap_ratio and 100 * r.gap_ratio, '%.1f%%'),
+                na(r.offset, '%+d')))
+        return lines
+
+
+class HistoryStore(object):
+    # the previous values that some sensors send along with their telegrams,
+    # kept per sensor so that missed archive intervals can be filled in.
+    # the values of a sensor at the same time are merged into one packet.
+    # each sensor keeps the packets of at most max_size timestamps.
+
+    def __init__(self, max_size=256):
+        self._max_size = max_size
+        self.sensors = dict() # (sensor_id, packet_type) -> {ts: packet}
+
+    def add(self, pkt):
+        if pkt is None:
+            return
+        packets = self.sensors.setdefault(
+            (pkt.sensor_id, pkt.packet_type), dict())
+        ts = pkt.timestamp
+        if ts in packets:
+            packets[ts].merge(pkt)
+        else:
+            packets[ts] = pkt.copy()
+            if len(packets) > self._max_size:
+                del packets[min(packets)]
+
+    def get_packets(self, since_ts=0):
+        # the packets after since_ts, in time order
+        pkts = [pkt for packets in self.sensors.values()
+                for ts, pkt in packets.items() if ts > since_ts]
+        pkts.sort(key=lambda p: p.timestamp)
+        return pkts
+
+
+class AutoTuner(object):
+    # try tfrec tuning options one at a time, and keep the ones with which
+    # the most telegrams are decoded.  each command runs for window seconds,
+    # of which the first SETTLE_TIME are ignored.  the gains are tried
+    # first, then the trigger levels with the best gain, then the center
+    # frequency corrected by the mean offset that the sensors reported with
+    # the best options so far.  the score is the number of telegrams per
+    # minute from the mapped sensors, or from all sensors if none is mapped,
+    # after duplicates have been dropped.  the best command is saved to a
+    # file, if any, with the command that it was tuned from.
+
+    SETTLE_TIME = 10
+    DEFAULT_FREQUENCY = 868250000 # Hz
+    MIN_OFFSET = 3 # kHz
+
+    def __init__(self, cmd, gains=None, triggers=None, window=600,
+                 filename=None):
+        self._cmd = cmd
+        self._filename = filename
+        self._window = window
+        self._settle = min(AutoTuner.SETTLE_TIME, window / 4.0)
+        self._stages = deque([('-g', gains or []), ('-t', triggers or []),
+                              ('-f', None)])
+        self._candidates = deque()
+        self._tried = set([cmd])
+        self.current = cmd
+        self.best = None # (score, cmd, offset)
+        self.done = False
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self._start = now
+        self._counts = dict() # (sensor_id, packet_type) -> telegrams
+        self._mapped = set()
+        self._offsets = dict() # (sensor_id, packet_type) -> [offset, ...]
+
+    def add(self, pkt, mapped=False, now=None):
+        now = now or time.time()
+        if self.done or now - self._start < self._settle:
+            return
+        key = (pkt.sensor_id, pkt.packet_type)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        if mapped:
+            self._mapped.add(key)
+        offset = pkt.values.get('offset')
+        if offset is not None:
+            self._offsets.setdefault(key, []).append(offset)
+
+    def _score(self, now):
+        keys = self._mapped or self._counts
+        elapsed = now - self._start - self._settle
+        score = 60.0 * sum(self._counts[k] for k in keys) / max(elapsed, 1)
+        offsets = [sum(v) / len(v) for v in self._offsets.values()]
+        offset = sum(offsets) / len(offsets) if offsets else None
+        return score, offset
+
+    def check(self, now=None):
+        # return the command to run next, or None to keep the current one
+        now = now or time.time()
+        if self.done or now - self._start < self._window:
+            return None
+        score, offset = self._score(now)
+        loginf("auto-tune: %.1f telegrams per minute with '%s'" % (
+            score, self.current))
+        if self.best is None or score > self.best[0]:
+            self.best = (score, self.current, offset)
+        self._reset(now)
+        while not self._candidates:
+            if not self._stages:
+                self.done = True
+                loginf("auto-tune: best is '%s' with %.1f telegrams"
+                       " per minute" % (self.best[1], self.best[0]))
+                self._save()
+                if self.best[1] == self.current:
+                    return None
+                self.current = self.best[1]
+                return self.current
+            flag, values = self._stages.popleft()
+            base = self.best[1]
+            if values is None:
+                values = AutoTuner.get_frequencies(base, self.best[2])
+            for value in values:
+                cmd = AutoTuner.set_option(base, flag, value)
+                if cmd not in self._tried:
+                    self._tried.add(cmd)
+                    self._candidates.append(cmd)
+        self.current = self._candidates.popleft()
+        return self.current
+
+    def _save(self):
+        if not self._filename:
+            return
+        tmp = '%s.tmp' % self._filename
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'cmd': self._cmd, 'best': self.best[1],
+                           'score': self.best[0]}, f, indent=2)
+            os.rename(tmp, self._filename)
+        except (IOError, OSError) as e:
+            logerr("cannot save auto-tune result to %s: %s" % (
+                self._filename, e))
+
+    @staticmethod
+    def load(filename, cmd):
+        # the best command saved for cmd, or None
+        if not filename:
+            return None
+        try:
+            with open(filename) as f:
+                saved = json.load(f)
+            if saved['cmd'] == cmd:
+                return saved['best']
+            loginf("auto-tune: %s is for another cmd" % filename)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    @staticmethod
+    def get_frequencies(cmd, offset):
+        # tfrec prints the offset to subtract from the center frequency.  try
+        # the full correction and half of it.  -f is in Hz or in kHz.
+        if offset is None or abs(offset) < AutoTuner.MIN_OFFSET:
+            return []
+        freq = AutoTuner.get_option(cmd, '-f')
+        freq = float(freq) if freq else AutoTuner.DEFAULT_FREQUENCY
+        scale = 1000 if freq >= 1e6 else 1
+        return [int(round(freq - offset * scale)),
+                int(round(freq - offset * scale / 2.0))]
+
+    @staticmethod
+    def get_option(cmd, flag):
+        parts = cmd.split()
+        if flag in parts[:-1]:
+            return parts[parts.index(flag) + 1]
+        return None
+
+    @staticmethod
+    def set_option(cmd, flag, value):
+        # the command with the option set to value, after the program name
+        parts = cmd.split()
+        value = str(value)
+        if flag in parts[:-1]:
+            parts[parts.index(flag) + 1] = value
+        else:
+            parts[1:1] = [flag, value]
+        return ' '.join(parts)
+
+
+class DriverStats(object):
+    # counters and cumulative time spent in each stage of the driver, for
+    # inspecting a running station without debug logging.  a snapshot is
+    # written as json to a file every interval seconds, and when a dump is
+    # requested, for example by a signal.  the file is replaced atomically.
+    # the stages are timed with the cpu time of the driver thread, so the
+    # reader threads and the time spent waiting are left out.
+
+    clock = staticmethod(getattr(time, 'thread_time', time.time))
+    CLOCK_NAME = 'thread_time' if hasattr(time, 'thread_time') else 'time'
+
+    def __init__(self, filename, interval=0):
+        self.counters = dict()
+        self.timings = dict()
+        self._filename = filename
+        self._interval = interval
+        self._started = time.time()
+        self._next_dump = self._started + interval if interval else None
+        self._dump_requested = False
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def request_dump(self, signum=None, _frame=None):
+        # safe to use as a signal handler: the dump happens later, in the
+        # driver thread
+        self._dump_requested = True
+
+    def snapshot(self, mgr=None):
+        return {
+            'driver_version': DRIVER_VERSION,
+            'time': time.time(),
+            'uptime': time.time() - self._started,
+            'counters': dict(self.counters),
+            'timings': dict(self.timings),
+            'clock': DriverStats.CLOCK_NAME,
+            'queues': mgr.queue_depths() if mgr is not None else {}}
+
+    def check_dump(self, mgr=None):
+        if self._dump_requested or (
+            self._next_dump is not None and time.time() >= self._next_dump):
+            self._dump_requested = False
+            if self._next_dump is not None:
+                self._next_dump = time.time() + self._interval
+            self.dump(mgr)
+
+    def dump(self, mgr=None):
+        tmp = '%s.tmp' % self._filename
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.snapshot(mgr), f, indent=2, sort_keys=True)
+            os.rename(tmp, self._filename)
+        except (IOError, OSError) as e:
+            logerr("cannot write stats to %s: %s" % (self._filename, e))
+
+
+class Profiler(object):
+    # profile the driver on demand.  while a profile runs, cProfile records
+    # the calls made in the thread that started it, and tracemalloc the
+    # memory allocated by every thread, including the readers.  a profile
+    # runs for duration seconds, or until it is toggled off, and is then
+    # written to the directory as tfrc-<time>.prof, for pstats, and as
+    # tfrc-<time>.mem, with the allocations by line and their growth during
+    # the profile.  a toggle requested from a signal handler takes effect in
+    # check.  nothing is imported or recorded until a profile starts.
+
+    TOP_LINES = 30
+
+    def __init__(self, directory, duration=0):
+        self._directory = directory
+        self._duration = duration
+        self._profile = None
+        self._snapshot = None
+        self._started = None
+        self._tracing = False # whether start started tracemalloc
+        self._toggle_requested = False
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def request_toggle(self, signum=None, _frame=None):
+        self._toggle_requested = True
+
+    def check(self, mgr=None):
+        if self._toggle_requested:
+            self._toggle_requested = False
+            self.toggle(mgr)
+        elif (self._profile is not None and self._duration and
+              time.time() - self._started >= self._duration):
+            self.stop(mgr)
+
+    def toggle(self, mgr=None):
+        if self._profile is None:
+            self.start()
+        else:
+            self.stop(mgr)
+
+    def start(self):
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # another profiler is active
+            logerr("cannot start profile: %s" % e)
+            return
+        self._profile = profile
+        self._started = time.time()
+        try:
+            import tracemalloc
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+        except ImportError:
+            # python 2
+            self._snapshot = None
+        loginf("profile started")
+
+    def stop(self, mgr=None):
+        if self._profile is None:
+            return
+        self._profile.disable()
+        prefix = os.path.join(self._directory, 'tfrc-%s' % time.strftime(
+            '%Y%m%d-%H%M%S', time.localtime(self._started)))
+        try:
+            if self._snapshot is not None:
+                self._write_memory(prefix + '.mem', mgr)
+            self._profile.dump_stats(prefix + '.prof')
+            loginf("profile of %.0f seconds written to %s.*" % (
+                time.time() - self._started, prefix))
+        except (IOError, OSError) as e:
+            logerr("cannot write profile to %s: %s" % (prefix, e))
+        self._profile = None
+        self._snapshot = None
+        if self._tracing:
+            # leave tracemalloc running if someone else started it
+            import tracemalloc
+            self._tracing = False
+            tracemalloc.stop()
+
+    def _write_memory(self, filename, mgr=None):
+        import cProfile
+        import tracemalloc
+        # leave out what the profilers themselves allocate
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, cProfile.__file__)])
+        current, peak = tracemalloc.get_traced_memory()
+        with open(filename, 'w') as f:
+            f.write("traced %d bytes, peak %d bytes\n" % (current, peak))
+            if mgr is not None:
+                f.write("queues %s\n" % json.dumps(
+                    mgr.queue_depths(), sort_keys=True))
+            f.write("\nallocated, by line:\n")
+            for stat in snapshot.statistics('lineno')[:Profiler.TOP_LINES]:
+                f.write("%s\n" % stat)
+            f.write("\ngrowth since the start of the profile, by line:\n")
+            for stat in snapshot.compare_to(
+                    self._snapshot, 'lineno')[:Profiler.TOP_LINES]:
+                f.write("%s\n" % stat)
+
+
 class TFRCConfigurationEditor(weewx.drivers.AbstractConfEditor):
     @property
     def default_stanza(self):
@@ -648,59 +3157,508 @@ class TFRCDriver(weewx.drivers.AbstractDevice):
         'rain': 'rain_total',
         'strikes': 'strikes_total'}
 
+    # in archive records from the history, directions get a vector mean and
+    # states take the last value in the interval instead of the mean.
+    DIRECTION_OBS = ['wind_dir']
+    STATE_OBS = ['state', 'state_age', 'rain_age']
+
+    # the longest that the wait for history goes on past history_wait
+    HISTORY_POLL = 1
+
     def __init__(self, **stn_dict):
         loginf('driver version is %s' % DRIVER_VERSION)
         self._log_unknown = tobool(stn_dict.get('log_unknown_sensors', False))
         self._log_unmapped = tobool(stn_dict.get('log_unmapped_sensors', False))
-        self._sensor_map = stn_dict.get('sensor_map', {})
+        self._sensor_map = SensorMap(stn_dict.get('sensor_map', {}))
         loginf('sensor map is %s' % self._sensor_map)
-        self._deltas = stn_dict.get('deltas', TFRCDriver.DEFAULT_DELTAS)
-        loginf('deltas is %s' % self._deltas)
+        # the delta -> counter total pairs, also used by the service
+        self.deltas = stn_dict.get('deltas', TFRCDriver.DEFAULT_DELTAS)
+        loginf('deltas is %s' % self.deltas)
         self._counter_values = dict()
         cmd = stn_dict.get('cmd', DEFAULT_CMD)
         path = stn_dict.get('path', None)
         ld_library_path = stn_dict.get('ld_library_path', None)
         self._last_pkt = None # avoid duplicate sequential packets
-        self._mgr = ProcManager()
+        # avoid duplicates from the same sensor, even if not sequential
+        dedup_window = int(stn_dict.get('dedup_window', 30))
+        loginf('dedup window is %s' % dedup_window)
+        self._dedup = DuplicateFilter(dedup_window) if dedup_window else None
+        # reception quality from sequence gaps and rssi
+        loss_fields = tobool(stn_dict.get('loss_fields', False))
+        self._reception_interval = int(
+            stn_dict.get('reception_log_interval', 0))
+        if loss_fields or self._reception_interval:
+            self._reception = ReceptionStats(loss_fields)
+        else:
+            self._reception = None
+        self._next_reception_log = time.time() + self._reception_interval
+        # counters and stage timings, dumped to a file
+        stats_file = stn_dict.get('stats_file', None)
+        self._stats = None
+        if stats_file:
+            stats_interval = int(stn_dict.get('stats_interval', 300))
+            loginf('stats file is %s, interval %s' % (
+                stats_file, stats_interval))
+            self._stats = DriverStats(stats_file, stats_interval)
+            try:
+                signal.signal(signal.SIGUSR1, self._stats.request_dump)
+            except ValueError:
+                # signals can only be set from the main thread
+                logdbg("cannot dump stats on SIGUSR1")
+        # profiles of the driver, on demand
+        self._profiler = None
+        profile_dir = stn_dict.get('profile_dir', None)
+        if profile_dir:
+            profile_duration = int(stn_dict.get('profile_duration', 0))
+            loginf('profile dir is %s, duration %s' % (
+                profile_dir, profile_duration))
+            self._profiler = Profiler(profile_dir, profile_duration)
+            try:
+                signal.signal(signal.SIGUSR2, self._profiler.request_toggle)
+            except ValueError:
+                logdbg("cannot toggle profile on SIGUSR2")
+            if tobool(stn_dict.get('profile', False)):
+                self._profiler.request_toggle()
+        # seconds without output after which weewx gets control back
+        self._idle_timeout = int(stn_dict.get('idle_timeout', 10))
+        loginf('idle timeout is %s' % self._idle_timeout)
+        # one receiver per command
+        cmds = cmd if isinstance(cmd, list) else [cmd]
+        ingest = stn_dict.get('ingest', 'debug')
+        loginf('ingest is %s' % ingest)
+        if ingest == 'handler':
+            handler = stn_dict.get('handler', DEFAULT_HANDLER)
+            cmds = [PacketFactory.get_handler_cmd(c, handler) for c in cmds]
+            cmd = cmds if len(cmds) > 1 else cmds[0]
+        elif ingest != 'debug':
+            raise weewx.ViolatedPrecondition("unknown ingest '%s'" % ingest)
+        mask = 0
+        for c in cmds:
+            mask |= PacketFactory.get_type_mask(c)
+        PacketFactory.configure(mask)
+        self._merger = None
+        if len(cmds) > 1:
+            merge_window = float(stn_dict.get('merge_window', 1.0))
+            loginf('merge window for %d receivers is %s' % (
+                len(cmds), merge_window))
+            self._merger = ReceiverMerger(merge_window)
+        self._coalescer = None
+        coalesce_window = float(stn_dict.get('coalesce_window', 0))
+        if coalesce_window:
+            loginf('coalesce window is %s' % coalesce_window)
+            self._coalescer = PacketCoalescer(coalesce_window)
+        # previous values from the sensors, to fill in missed intervals
+        self._history = None
+        self._history_interval = int(stn_dict.get('history_interval', 0))
+        self._history_wait = int(stn_dict.get('history_wait', 0))
+        self._startup_packets = []
+        self._lines = None # the generator of lines from the manager
+        self._last_ts = None # the time of the last loop packet
+        if self._history_interval:
+            history_size = int(stn_dict.get('history_size', 256))
+            loginf('history interval is %s, size %s, wait %s' % (
+                self._history_interval, history_size, self._history_wait))
+            self._history = HistoryStore(history_size)
+        replay_file = stn_dict.get('replay_file', None)
+        ring_file = stn_dict.get('ring_file', None)
+        duty_window = int(stn_dict.get('duty_window', 0))
+        if ring_file:
+            # the collector decides which sensor types are received
+            PacketFactory.configure(sum(
+                p.TYPE_MASK for p in PacketFactory.KNOWN_PACKETS))
+            self._mgr = RingManager(ring_file)
+        elif replay_file:
+            replay_speed = float(stn_dict.get('replay_speed', 0))
+            replay_hold = tobool(stn_dict.get('replay_hold', True))
+            self._mgr = ReplayManager(replay_file, replay_speed, replay_hold)
+        elif duty_window:
+            # tfrec runs the handler for each sensor at the end of a window
+            if len(cmds) > 1:
+                raise weewx.ViolatedPrecondition(
+                    "duty_window needs a single cmd")
+            if ingest != 'handler':
+                cmd = PacketFactory.get_handler_cmd(
+                    cmd, stn_dict.get('handler', DEFAULT_HANDLER))
+            duty_interval = int(stn_dict.get('duty_interval', 300))
+            loginf('duty window is %s, interval %s' % (
+                duty_window, duty_interval))
+            self._mgr = DutyCycleManager(
+                duty_window, duty_interval, stn_dict.get('reader', 'thread'),
+                stn_dict.get('pid_file'))
+        else:
+            reader = stn_dict.get('reader', 'thread')
+            loginf('reader is %s' % reader)
+            queue_size = int(stn_dict.get('queue_size', 0))
+            queue_policy = stn_dict.get('queue_policy', 'drop-oldest')
+            if queue_size:
+                loginf('queue size is %s, policy %s' % (
+                    queue_size, queue_policy))
+            max_restarts = int(stn_dict.get('max_restarts', 5))
+            stall_timeout = int(stn_dict.get('stall_timeout', 120))
+            loginf('max restarts is %s, stall timeout %s' % (
+                max_restarts, stall_timeout))
+            pid_file = stn_dict.get('pid_file')
+            loginf('pid file is %s' % pid_file)
+            self._mgr = ProcManager(reader, queue_size, queue_policy,
+                                    max_restarts, stall_timeout, pid_file)
+        # try other tfrec options and keep the best
+        self._tuner = None
+        if tobool(stn_dict.get('auto_tune', False)):
+            if not isinstance(self._mgr, ProcManager) or len(cmds) > 1:
+                loginf('auto-tune needs a single tfrec command')
+            else:
+                gains = stn_dict.get('tune_gains', '-1, 20, 30, 40, 49')
+                triggers = stn_dict.get('tune_triggers', '0, 200, 400, 700')
+                if not isinstance(gains, list):
+                    gains = [x.strip() for x in gains.split(',')]
+                if not isinstance(triggers, list):
+                    triggers = [x.strip() for x in triggers.split(',')]
+                tune_window = int(stn_dict.get('tune_window', 600))
+                tune_file = stn_dict.get('tune_file')
+                pid_file = stn_dict.get('pid_file')
+                if not tune_file and pid_file:
+                    tune_file = os.path.splitext(pid_file)[0] + '.tune'
+                loginf('auto-tune gains %s, triggers %s, window %s, file %s' %
+                       (gains, triggers, tune_window, tune_file))
+                tuned = AutoTuner.load(tune_file, cmd)
+                if tuned is not None:
+                    loginf("auto-tune: run '%s' from %s" % (tuned, tune_file))
+                    cmd = tuned
+                else:
+                    self._tuner = AutoTuner(cmd, gains, triggers, tune_window,
+                                            tune_file)
         self._mgr.startup(cmd, path, ld_library_path)
 
     def closePort(self):
+        if self._profiler is not None:
+            self._profiler.stop(self._mgr)
         self._mgr.shutdown()
 
     @property
     def hardware_name(self):
         return 'TFRC'
 
+    @property
+    def manager(self):
+        # the source of the lines: a ProcManager, or one of the managers
+        # that stand in for it
+        return self._mgr
+
+    @property
+    def stats(self):
+        # the DriverStats, or None without stats_file
+        return self._stats
+
+    def genStartupRecords(self, since_ts):
+        # catch up on the intervals missed since since_ts, once the sensors
+        # have had history_wait seconds to send their history
+        if self._history is None:
+            raise NotImplementedError("history_interval is not set")
+        if self._history_wait:
+            self._wait_for_history(self._history_wait)
+        for record in self.genArchiveRecords(since_ts):
+            yield record
+
+    def _wait_for_history(self, wait):
+        # read telegrams for a while, and keep their packets for the loop.
+        # the lines come from the generator that the loop goes on with, so
+        # that nothing the manager holds is lost in between.
+        loginf("wait %s seconds for history" % wait)
+        deadline = time.time() + wait
+        lines = self._get_lines()
+        end = object()
+        while time.time() < deadline:
+            line = next(lines, end)
+            if line is end:
+                # a replay or a ring that has ended
+                break
+            if line is not None:
+                pending = self._mgr.pending
+                pending.appendleft(line)
+                self._startup_packets.extend(
+                    PacketFactory.create(pending, True, self._stats,
+                                         self._history))
+
+    def _get_lines(self):
+        # the one generator of lines from the manager.  the merger and the
+        # coalescer release their packets when tfrec is quiet, whether or not
+        # there is a heartbeat, so it times out with the shortest of these.
+        # with history_wait it also times out every HISTORY_POLL seconds, so
+        # that the wait for history ends on time when tfrec is quiet.
+        if self._lines is None:
+            timeouts = [self._idle_timeout]
+            if self._history is not None and self._history_wait:
+                timeouts.append(TFRCDriver.HISTORY_POLL)
+            if self._merger is not None:
+                timeouts.append(self._merger.window)
+            if self._coalescer is not None:
+                timeouts.append(self._coalescer.window)
+            timeout = min([t for t in timeouts if t] or [0])
+            self._lines = self._mgr.get_lines(timeout)
+        return self._lines
+
+    def genArchiveRecords(self, since_ts):
+        # make an archive record for each interval after since_ts from the
+        # history of the sensors.  observations are averaged over the
+        # interval, except for the cumulative ones in deltas, which take the
+        # last value in the interval and give the deltas between intervals.
+        # directions get a vector mean, and states take the last value.
+        if self._history is None:
+            raise NotImplementedError("history_interval is not set")
+        interval = self._history_interval
+        now = time.time()
+        intervals = OrderedDict()
+        for pkt in self._history.get_packets(since_ts or 0):
+            packet = self.map_to_fields(pkt, self._sensor_map)
+            if not packet:
+                continue
+            end = -(-pkt.timestamp // interval) * interval
+            if end <= now:
+                intervals.setdefault(end, []).append(packet)
+        cumulative = set(self.deltas.values())
+        directions = set()
+        last = set(cumulative)
+        for k in self._sensor_map:
+            obs = self._sensor_map.get_observation(k)
+            if (obs in TFRCDriver.DIRECTION_OBS or
+                weewx.units.obs_group_dict.get(k) == 'group_direction'):
+                directions.add(k)
+            elif obs in TFRCDriver.STATE_OBS:
+                last.add(k)
+        counter_values = dict()
+        for end, packets in intervals.items():
+            values = dict()
+            for packet in packets:
+                for k, v in packet.items():
+                    if k not in ['dateTime', 'usUnits'] and v is not None:
+                        values.setdefault(k, []).append(v)
+            record = dict()
+            for k, v in values.items():
+                if k in last:
+                    record[k] = v[-1]
+                elif k in directions:
+                    record[k] = TFRCDriver._mean_direction(v)
+                else:
+                    record[k] = sum(v) / len(v)
+            for k, label in self.deltas.items():
+                if label in record:
+                    record[k] = self._calculate_delta(
+                        label, record[label], counter_values.get(label))
+                    counter_values[label] = record[label]
+            record['dateTime'] = end
+            record['usUnits'] = weewx.METRIC
+            record['interval'] = interval // 60
+            logdbg("history record: %s" % record)
+            yield record
+
+    @staticmethod
+    def _mean_direction(values):
+        # the direction of the sum of unit vectors, or None if they cancel
+        x = sum(math.sin(math.radians(d)) for d in values)
+        y = sum(math.cos(math.radians(d)) for d in values)
+        if abs(x) < 1e-9 and abs(y) < 1e-9:
+            return None
+        return round(math.degrees(math.atan2(x, y)), 3) % 360
+
     def genLoopPackets(self):
-        while self._mgr.running():
-            for lines in self._mgr.get_stdout():
-                ###logdbg("genLoopPackets lines:%s" % lines)
-                for packet in PacketFactory.create(lines):
+        for packet in self._gen_loop_packets():
+            self._last_ts = packet['dateTime']
+            yield packet
+
+    def _gen_loop_packets(self):
+        stats = self._stats
+        clock = time.time
+        # the packets read while waiting for history at startup
+        startup_packets, self._startup_packets = self._startup_packets, []
+        for packet in startup_packets:
+            for packet in self._output(packet):
+                yield packet
+        last_output = clock()
+        for line in self._get_lines():
+            if stats is not None:
+                stats.check_dump(self._mgr)
+            if self._profiler is not None:
+                self._profiler.check(self._mgr)
+            if self._tuner is not None:
+                self._tune()
+            if line is None:
+                # nothing from tfrec for a while.  hand weewx a packet with
+                # no observations so that it can get on with its own work.
+                self._idle()
+                packets = []
+                if self._merger is not None:
+                    for packet, pline in self._merge([]):
+                        packets.extend(self._output(packet, pline))
+                if self._coalescer is not None:
+                    packet = self._coalescer.flush()
                     if packet:
-                        packet = self.map_to_fields(packet, self._sensor_map)
-                        if packet:
-                            if packet != self._last_pkt:
-                                ###logdbg("packet=%s" % packet)
-                                self._last_pkt = packet
-                                self._calculate_deltas(packet)
-                                yield packet
-                            else:
-                                logdbg("ignoring duplicate packet %s" % packet)
-                        elif self._log_unmapped:
-                            loginf("unmapped: %s (%s)" % (lines, packet))
-                    elif self._log_unknown:
-                        logdbg("info: %s" % lines)
-            self._mgr.get_stderr() # flush the stderr queue
-        else:
-            logerr("err: %s" % self._mgr.get_stderr())
-            raise weewx.WeeWxIOError("tfrc process is not running")
+                        packets.append(packet)
+                for packet in packets:
+                    yield packet
+                now = clock()
+                if packets:
+                    last_output = now
+                elif (self._idle_timeout and
+                      now - last_output >= self._idle_timeout):
+                    last_output = now
+                    packet = self._heartbeat()
+                    if packet is not None:
+                        yield packet
+                continue
+            last_output = clock()
+            # the lines after this one from the same transmission are parsed
+            # with it, and are not passed on by the manager again
+            lines = self._mgr.pending
+            lines.appendleft(line)
+            if stats is None:
+                packets = list(PacketFactory.create(
+                    lines, True, history=self._history))
+            else:
+                n = len(lines)
+                t0 = stats.clock()
+                packets = list(PacketFactory.create(
+                    lines, True, stats, self._history))
+                stats.add_time('parse', stats.clock() - t0)
+                stats.count('lines_read', n - len(lines))
+            if self._merger is not None:
+                for packet, pline in self._merge(packets, line):
+                    for packet in self._output(packet, pline):
+                        yield packet
+                continue
+            for packet in packets:
+                for packet in self._output(packet, line):
+                    yield packet
+        packets = []
+        if self._merger is not None:
+            for packet, pline in self._merger.flush():
+                packets.extend(self._output(packet, pline))
+        if self._coalescer is not None:
+            packet = self._coalescer.flush()
+            if packet:
+                packets.append(packet)
+        for packet in packets:
+            yield packet
+        # the lines have ended, so the next call starts over
+        self._lines = None
+        if isinstance(self._mgr, ReplayManager):
+            raise weewx.WeeWxIOError("replay is finished")
+        if isinstance(self._mgr, RingManager):
+            return
+        err = self._mgr.get_stderr()
+        if err:
+            logerr("err: %s" % err)
+        raise weewx.WeeWxIOError("tfrc process is not running")
+
+    def _output(self, packet, line=None):
+        # return the loop packets that are ready for weewx
+        packet = self._process_packet(packet, line)
+        if not packet:
+            return []
+        if self._coalescer is None:
+            return [packet]
+        merged = self._coalescer.merged
+        packets = self._coalescer.add(packet)
+        if self._stats is not None and self._coalescer.merged != merged:
+            self._stats.count('coalesced')
+        return packets
+
+    def _merge(self, packets, line=None):
+        merged = self._merger.merged
+        packets = self._merger.merge(packets, line=line)
+        if self._stats is not None and self._merger.merged != merged:
+            self._stats.count('receiver_duplicates',
+                              self._merger.merged - merged)
+        return packets
+
+    def _process_packet(self, packet, line=None):
+        # filter and map a parsed packet.  return the mapped packet, or None
+        # if there is nothing to pass on to weewx.
+        stats = self._stats
+        clock = stats.clock if stats is not None else None
+        if packet is None:
+            if self._log_unknown:
+                logdbg("info: %s" % line)
+            return None
+        if stats is not None:
+            t0 = clock()
+        if self._dedup and self._dedup.is_duplicate(packet):
+            logdbg("ignoring repeated telegram %s" % line)
+            if stats is not None:
+                stats.count('duplicates_dropped')
+                stats.add_time('dedup', clock() - t0)
+            return None
+        if stats is not None:
+            t1 = clock()
+            stats.add_time('dedup', t1 - t0)
+        if self._reception is not None:
+            self._reception.add(packet)
+            if (self._reception_interval and
+                time.time() >= self._next_reception_log):
+                self._reception.log_summary()
+                self._next_reception_log = (
+                    time.time() + self._reception_interval)
+            if stats is not None:
+                t0 = clock()
+                stats.add_time('reception', t0 - t1)
+                t1 = t0
+        raw = packet
+        packet = self.map_to_fields(packet, self._sensor_map)
+        if stats is not None:
+            t0 = clock()
+            stats.add_time('map', t0 - t1)
+        if self._tuner is not None:
+            self._tuner.add(raw, bool(packet))
+        if not packet:
+            if stats is not None:
+                stats.count('unmapped')
+            if self._log_unmapped:
+                loginf("unmapped: %s (%s)" % (line, raw))
+            return None
+        if packet == self._last_pkt:
+            logdbg("ignoring duplicate packet %s" % packet)
+            if stats is not None:
+                stats.count('duplicates_dropped')
+            return None
+        ###logdbg("packet=%s" % packet)
+        self._last_pkt = packet
+        self._calculate_deltas(packet)
+        if stats is not None:
+            stats.add_time('deltas', clock() - t0)
+            stats.count('packets')
+        return packet
+
+    def _tune(self):
+        # run tfrec with the next options to try, if it is time to
+        cmd = self._tuner.check()
+        if cmd is not None:
+            self._mgr.restart(cmd)
+
+    def _heartbeat(self):
+        # a packet with no observations.  a replay or a ring has telegrams
+        # from before now, so the heartbeat has the time of the last packet,
+        # or there is none until there is a packet.
+        if isinstance(self._mgr, (ReplayManager, RingManager)):
+            if self._last_ts is None:
+                return None
+            return {'dateTime': self._last_ts, 'usUnits': weewx.METRIC}
+        return {'dateTime': int(time.time() + 0.5), 'usUnits': weewx.METRIC}
+
+    def _idle(self):
+        # housekeeping while there is no output from tfrec
+        if self._stats is not None:
+            self._stats.count('idle')
+        for line in self._mgr.get_stderr():
+            logdbg("err: %s" % line.rstrip())
 
     def _calculate_deltas(self, pkt):
-        for k in self._deltas:
-            label = self._deltas[k]
+        for k in self.deltas:
+            label = self.deltas[k]
             if label in pkt:
-                pkt[k] = self._calculate_delta(
-                    label, pkt[label], self._counter_values.get(label))
+                oldtotal = self._counter_values.get(label)
+                pkt[k] = self._calculate_delta(label, pkt[label], oldtotal)
+                if (pkt[k] is None and self._stats is not None and
+                    None not in (pkt[label], oldtotal)):
+                    self._stats.count('delta_decrements')
                 self._counter_values[label] = pkt[label]
 
     @staticmethod
@@ -720,73 +3678,167 @@ class TFRCDriver(weewx.drivers.AbstractDevice):
         # map.  if the identifier is found, then use its value.  if not, then
         # skip it completely (it is not given a None value).  include the
         # time stamp and unit system only if we actually got data.
-        packet = dict()
-        for n in sensor_map.keys():
-            label = TFRCDriver._find_match(sensor_map[n], pkt.keys())
-            if label:
-                packet[n] = pkt.get(label)
+        if not isinstance(sensor_map, SensorMap):
+            sensor_map = SensorMap(sensor_map)
+        packet = sensor_map.map_packet(pkt)
         if packet:
-            for k in ['dateTime', 'usUnits']:
-                packet[k] = pkt[k]
+            if isinstance(pkt, Reading):
+                packet['dateTime'] = pkt.timestamp
+                packet['usUnits'] = pkt.units
+            else:
+                for k in ['dateTime', 'usUnits']:
+                    packet[k] = pkt[k]
         return packet
 
-    @staticmethod
-    def _find_match(pattern, keylist):
-        # find the first key in pkt that matches the specified pattern.
-        # the general form of a pattern is:
-        #   <observation_name>.<sensor_id>.<packet_type>
-        # do glob-style matching.
-        if pattern in keylist:
-            return pattern
-        match = None
-        pparts = pattern.split('.')
-        if len(pparts) == 3:
-            for k in keylist:
-                kparts = k.split('.')
-                if (len(kparts) == 3 and
-                    TFRCDriver._part_match(pparts[0], kparts[0]) and
-                    TFRCDriver._part_match(pparts[1], kparts[1]) and
-                    TFRCDriver._part_match(pparts[2], kparts[2])):
-                    match = k
-                    break
-                elif pparts[0] == k:
-                    match = k
-                    break
-        return match
 
-    @staticmethod
-    def _part_match(pattern, value):
-        # use glob matching for parts of the tuple
-        matches = fnmatch.filter([value], pattern)
-        return True if matches else False
+class TFRCService(weewx.engine.StdService):
+    # run the driver pipeline in a thread of its own, alongside another
+    # station driver, and keep the latest value of each mapped field with
+    # the time it was measured.  each loop packet of the other driver gets
+    # the fields that are no older than max_age seconds and that it does not
+    # have already.  the deltas are added up until the next loop packet,
+    # which takes them, or drops them if it has deltas of its own.
+    # the loop packet never waits for the pipeline: if the cache is being
+    # updated at that moment, the packet goes without.
+
+    RESTART_DELAY = 60
+
+    def __init__(self, engine, config_dict):
+        super(TFRCService, self).__init__(engine, config_dict)
+        self._stn_dict = dict(config_dict.get(DRIVER_NAME, {}))
+        self._stn_dict.setdefault(
+            'pid_file', get_pid_file(config_dict.get('config_path')))
+        self._max_age = int(self._stn_dict.get('max_age', 300))
+        loginf('service max age is %s' % self._max_age)
+        self._cache = dict() # field -> [value, dateTime]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._driver = TFRCDriver(**self._stn_dict)
+        self._accumulate = set(self._driver.deltas)
+        self._thread = threading.Thread(target=self._run, name='tfrc-service')
+        self._thread.daemon = True
+        self._thread.start()
+        self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for packet in self._driver.genLoopPackets():
+                    self._update(packet)
+                    if self._stop.is_set():
+                        break
+            except weewx.WeeWxIOError as e:
+                if not self._stop.is_set():
+                    logerr("service pipeline failed: %s" % e)
+            except Exception as e:
+                # anything else would end the thread without a word, and the
+                # station would go on without the tfrc fields
+                logerr("service pipeline failed: %s" % e)
+                for line in traceback.format_exc().splitlines():
+                    logerr("    %s" % line)
+            if self._stop.wait(TFRCService.RESTART_DELAY):
+                break
+            try:
+                self._driver.closePort()
+                self._driver = TFRCDriver(**self._stn_dict)
+            except Exception as e:
+                logerr("service restart failed: %s" % e)
+                continue
+            if self._stop.is_set():
+                # shutDown closed the old driver while this one was made
+                self._driver.closePort()
+                break
+
+    def _update(self, packet):
+        ts = packet.get('dateTime') or time.time()
+        with self._lock:
+            for k, v in packet.items():
+                if k in ['dateTime', 'usUnits'] or v is None:
+                    continue
+                entry = self._cache.get(k)
+                if k in self._accumulate and entry is not None:
+                    entry[0] += v
+                    entry[1] = ts
+                else:
+                    self._cache[k] = [v, ts]
+
+    def new_loop_packet(self, event):
+        if not self._lock.acquire(False):
+            return
+        try:
+            now = time.time()
+            values = dict()
+            for k, (v, ts) in self._cache.items():
+                if k in event.packet:
+                    continue
+                if k in self._accumulate:
+                    values[k] = v
+                elif now - ts <= self._max_age:
+                    values[k] = v
+            for k in self._accumulate:
+                # the sum since the last loop packet, taken or dropped
+                self._cache.pop(k, None)
+        finally:
+            self._lock.release()
+        if values:
+            values['usUnits'] = weewx.METRIC
+            values = weewx.units.to_std_system(
+                values, event.packet['usUnits'])
+            del values['usUnits']
+            event.packet.update(values)
+
+    def shutDown(self):
+        self._stop.set()
+        self._driver.closePort()
+        self._thread.join(10)
 
 
 ############################## Conf Editor ############################## 
 
 if __name__ == '__main__':
     import optparse
+    import sys
 
     usage = """%prog [--debug] [--help] [--version]
-        [--action=(show-packets | show-detected | list-supported)]
+        [--action=(show-packets | survey | list-supported |
+                   compare-parsers | show-loop | collect)]
         [--cmd=RTL_CMD] [--path=PATH] [--ld_library_path=LD_LIBRARY_PATH]
+        [--count=COUNT] [--replay=FILE [--speed=SPEED]] [--config=FILE]
+        [--ring=FILE [--ring-size=SIZE]] [--interval=SECONDS]
+        [--profile=DIR]
 
 Actions:
   show-packets: display each packet (default)
-  show-detected: display a running count of the number of each packet type
+  survey: display a table of the detected sensors, with the rate, last time
+    seen, rssi, lost telegrams and frequency offset of each, redrawn every
+    interval seconds.  show-detected is the old name of this action.
   list-supported: show a list of the supported packet types
+  compare-parsers: compare the throughput of the field and regex parsers
+  show-loop: display the loop packets from the driver, using the [TFRC]
+    stanza of the weewx configuration file
+  collect: run tfrec and write the telegrams to the ring file for a driver
+    with ring_file, using the cmd, path and handler of the [TFRC] stanza if
+    a configuration file is specified
+
+Replay:
+  Use the captured output of 'tfrec -D' in a file instead of running tfrec.
+  The speed is 0 for as fast as possible, 1 for real time.
+
+Profile:
+  Profile the action from start to end, and write the profile to DIR as
+  the driver does with profile_dir.  SIGUSR2 ends a profile early, or starts
+  another one.
 
 Hide:
   This is a comma-separate list of the types of data that should not be
   displayed.  Default is to show everything."""
 
-    syslog.openlog('tfrc', syslog.LOG_PID | syslog.LOG_CONS)
-    syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
     parser = optparse.OptionParser(usage=usage)
     parser.add_option('--version', dest='version', action='store_true',
                       help='display driver version')
     parser.add_option('--debug', dest='debug', action='store_true',
                       help='display diagnostic information while running')
-    parser.add_option('--cmd', dest='cmd', default=DEFAULT_CMD,
+    parser.add_option('--cmd', dest='cmd',
                       help='tfrc command with options')
     parser.add_option('--path', dest='path',
                       help='value for PATH')
@@ -795,58 +3847,181 @@ Hide:
     parser.add_option('--hide', dest='hidden', default='empty',
                       help='output to be hidden: out, parsed, unparsed, empty')
     parser.add_option('--action', dest='action', default='show-packets',
-                      help='actions include show-packets, show-detected, list-supported')
+                      help='actions include show-packets, survey, list-supported, compare-parsers')
+    parser.add_option('--count', dest='count', type=int, default=100000,
+                      help='number of lines to parse for compare-parsers')
+    parser.add_option('--replay', dest='replay', metavar='FILE',
+                      help='replay captured tfrec output from FILE')
+    parser.add_option('--speed', dest='speed', type=float, default=0,
+                      help='replay speed, 0 for as fast as possible')
+    parser.add_option('--config', dest='config', metavar='FILE',
+                      help='weewx configuration file for show-loop')
+    parser.add_option('--ring', dest='ring', metavar='FILE',
+                      help='ring file for collect')
+    parser.add_option('--ring-size', dest='ring_size', type=int,
+                      default=4096, help='records in the ring for collect')
+    parser.add_option('--interval', dest='interval', type=float, default=5,
+                      help='seconds between redraws of the survey')
+    parser.add_option('--profile', dest='profile', metavar='DIR',
+                      help='write a profile of the action to DIR')
 
     (options, args) = parser.parse_args()
 
+    # whether the command was given, or comes from the configuration file
+    cmd_given = options.cmd is not None
+    if not cmd_given:
+        options.cmd = DEFAULT_CMD
+
     if options.version:
         print("tfrc driver version %s" % DRIVER_VERSION)
         exit(1)
 
-    if options.debug:
-        syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_DEBUG))
+    try:
+        # new-style weewx logging
+        if options.debug:
+            weewx.debug = 1
+        weeutil.logger.setup('tfrc', {})
+    except AttributeError:
+        # old-style weewx logging: weeutil has no logger module
+        syslog.openlog('tfrc', syslog.LOG_PID | syslog.LOG_CONS)
+        syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_INFO))
+        if options.debug:
+            syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_DEBUG))
+
+    PacketFactory.configure(PacketFactory.get_type_mask(options.cmd))
+
+    profiler = None
+    if options.profile:
+        # the profile is written when the action ends, however it ends.
+        # SIGUSR2 toggles it, in the loop of the action.
+        import atexit
+        profiler = Profiler(options.profile)
+        signal.signal(signal.SIGUSR2, profiler.request_toggle)
+        atexit.register(profiler.stop)
+        profiler.start()
+
+    def check_profiler(mgr=None):
+        if profiler is not None:
+            profiler.check(mgr)
+
+    def start_manager(reader='thread'):
+        if options.replay:
+            mgr = ReplayManager(options.replay, options.speed)
+        else:
+            mgr = ProcManager(reader=reader)
+        mgr.startup(options.cmd, path=options.path,
+                    ld_library_path=options.ld_library_path)
+        return mgr
 
     if options.action == 'list-supported':
         for pt in PacketFactory.KNOWN_PACKETS:
-            print(pt.IDENTIFIER)
-    elif options.action == 'show-detected':
-        # display identifiers for detected sensors
-        mgr = ProcManager()
-        mgr.startup(options.cmd, path=options.path,
-                    ld_library_path=options.ld_library_path)
-        detected = dict()
-        for lines in mgr.get_stdout():
-#            print("out:", lines)
-            for p in PacketFactory.create(lines):
-                if p:
-                    del p['usUnits']
-                    del p['dateTime']
-                    keys = p.keys()
-                    label = re.sub(r'^[^\.]+', '', keys[0])
-                    if label not in detected:
-                        detected[label] = 0
-                    detected[label] += 1
-                print(detected)
+            print("%s (-T %x)" % (pt.__name__, pt.TYPE_MASK))
+    elif options.action == 'compare-parsers':
+        # parse the same TFA_1 lines with the field and regex parsers
+        lines = ['#%03d %d  2d d4 %02x b0 86 20 23 60 e0 56 97           '
+                 'ID %02xb0 +%.1f %d%% seq %x lowbat 0 RSSI %d' %
+                 (i, 1485215350 + i, i, i, 15 + i * 0.1, 30 + i, i % 16,
+                  60 + i) for i in range(32)]
+        for use_fields in [True, False]:
+            Packet.USE_FIELDS = use_fields
+            t0 = time.time()
+            n = 0
+            while n < options.count:
+                for p in PacketFactory.create(lines):
+                    n += 1
+                check_profiler()
+            elapsed = time.time() - t0
+            print("%s parser: %d lines in %.3fs (%.0f lines/s)" %
+                  ('field' if use_fields else 'regex', n, elapsed,
+                   n / elapsed))
+    elif options.action == 'show-loop':
+        # display the loop packets from the complete driver pipeline
+        stn_dict = dict()
+        if options.config:
+            import configobj
+            stn_dict.update(configobj.ConfigObj(options.config)[DRIVER_NAME])
+        if cmd_given or 'cmd' not in stn_dict:
+            stn_dict['cmd'] = options.cmd
+        if options.path:
+            stn_dict['path'] = options.path
+        if options.ld_library_path:
+            stn_dict['ld_library_path'] = options.ld_library_path
+        if options.replay:
+            stn_dict['replay_file'] = options.replay
+            stn_dict['replay_speed'] = options.speed
+            stn_dict['replay_hold'] = False
+        driver = TFRCDriver(**stn_dict)
+        try:
+            for pkt in driver.genLoopPackets():
+                print(weeutil.weeutil.timestamp_to_string(pkt['dateTime']),
+                      pkt)
+                check_profiler()
+        except weewx.WeeWxIOError as e:
+            print(e)
+        finally:
+            driver.closePort()
+    elif options.action == 'collect':
+        # run tfrec for a driver that reads the ring file
+        if not options.ring:
+            parser.error('collect needs a ring file')
+        stn_dict = dict(cmd=options.cmd, path=options.path,
+                        ld_library_path=options.ld_library_path)
+        if options.config:
+            import configobj
+            stn_dict.update(configobj.ConfigObj(options.config)[DRIVER_NAME])
+        collector = RingCollector(options.ring, options.ring_size)
+        signal.signal(signal.SIGTERM, collector.stop)
+        try:
+            collector.run(stn_dict['cmd'], stn_dict.get('path'),
+                          stn_dict.get('ld_library_path'),
+                          stn_dict.get('handler'))
+        except KeyboardInterrupt:
+            pass # run has shut tfrec down on the way out
+    elif options.action in ['survey', 'show-detected']:
+        # display the reception of each detected sensor.  the chunk reader
+        # passes on the lines of a transmission together, so that they are
+        # counted as one telegram.
+        mgr = start_manager('chunk')
+        survey = ReceptionStats(all_sensors=True)
+        clear = '\033[H\033[J' if sys.stdout.isatty() else ''
+        next_draw = time.time() + options.interval
+
+        def draw():
+            print(clear + '\n'.join(survey.format_table()))
+            print('%d sensors, %d unrecognized lines\n' %
+                  (len(survey.sensors), survey.unrecognized))
+            sys.stdout.flush()
+
+        try:
+            for line in mgr.get_lines(options.interval):
+                if line is not None:
+                    lines = mgr.pending
+                    lines.appendleft(line)
+                    survey.add_lines(lines)
+                check_profiler(mgr)
+                if time.time() >= next_draw:
+                    draw()
+                    next_draw = time.time() + options.interval
+        except KeyboardInterrupt:
+            pass
+        finally:
+            mgr.shutdown()
+        draw()
     else:
         # display output and parsed/unparsed packets
         hidden = [x.strip() for x in options.hidden.split(',')]
-        mgr = ProcManager()
-        mgr.startup(options.cmd, path=options.path,
-                    ld_library_path=options.ld_library_path)
-        for lines in mgr.get_stdout():
+        mgr = start_manager()
+        for line in mgr.get_lines():
             if 'out' not in hidden and (
-                'empty' not in hidden or len(lines)):
-                print("out:", lines)
-            for p in PacketFactory.create(lines):
-                if p:
-                    if 'parsed' not in hidden:
-                        print('parsed: %s' % p)
-                else:
-                    if 'unparsed' not in hidden and (
-                        'empty' not in hidden or len(lines)):
-                        print("unparsed:", lines)
-        while mgr.running():
-            for lines in mgr.get_stderr():
-                print("data:", lines)
-            for lines in mgr.get_stdout():
-                print("err: ", lines)
+                'empty' not in hidden or line.strip()):
+                print("out:", line.rstrip())
+            packets = list(PacketFactory.create([line]))
+            for p in packets:
+                if 'parsed' not in hidden:
+                    print('parsed: %s' % p)
+            if not packets and 'unparsed' not in hidden and (
+                'empty' not in hidden or line.strip()):
+                print("unparsed:", line.rstrip())
+            check_profiler(mgr)
+        for line in mgr.get_stderr():
+            print("err: ", line.rstrip())
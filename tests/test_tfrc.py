@@ -0,0 +1,490 @@
+# tests for the weewx-tfrc driver
+# Distributed under the terms of the GNU Public License (GPLv3)
+#
+# run from the top of the source tree:
+#   python -m unittest discover tests
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'bin', 'user'))
+
+import tfrc
+import weewx
+
+
+TFA_1_LINE = ('#001 1485215350  2d d4 65 b0 86 20 23 60 e0 56 97           '
+              'ID 65b0 +22.0 35%% seq %s lowbat 0 RSSI 81')
+WEATHERHUB_LINE = ('#002 1485215351  01 e4 88 75 34 a2 0f 0b 0d 04 c3        '
+                   '0b3d9dde0000%s +12.8 28 5 0 74 0 1485215351')
+RAIN_LINE = ('#003 %d  01 e4 88 75 34 a2 0f 0b 0d 04 c3        '
+             '0b3d9dde00002 +%.1f 28 %d 0 74 0 %d')
+
+
+class SurveyTest(unittest.TestCase):
+
+    def setUp(self):
+        tfrc.PacketFactory.configure(
+            tfrc.TFA_1Packet.TYPE_MASK | tfrc.WeatherHubPacket.TYPE_MASK)
+
+    def tearDown(self):
+        tfrc.PacketFactory.configure()
+
+    def survey(self, lines):
+        survey = tfrc.ReceptionStats(all_sensors=True)
+        lines = deque(lines)
+        while lines:
+            survey.add_lines(lines, now=1485215360)
+        return survey
+
+    def test_unparseable_line(self):
+        # a telegram that does not parse is counted, and does not stop the
+        # survey
+        survey = self.survey([TFA_1_LINE % 'e', TFA_1_LINE % 'zz', ''])
+        self.assertEqual(list(survey.sensors), [('65B0', 'TFA_1Packet')])
+        self.assertEqual(survey.unrecognized, 1)
+        self.assertEqual(len(survey.format_table(now=1485215360)), 2)
+
+    def test_unknown_subtype(self):
+        survey = self.survey([WEATHERHUB_LINE % '9', WEATHERHUB_LINE % '0'])
+        self.assertEqual(len(survey.sensors), 1)
+        self.assertEqual(survey.unrecognized, 1)
+
+
+class LineQueueTest(unittest.TestCase):
+
+    @staticmethod
+    def line(sensor, seq):
+        return TFA_1_LINE.replace('65b0', sensor) % seq
+
+    def test_keep_latest(self):
+        # when the queue is full, the oldest line of the same sensor is
+        # dropped, and the order of the others is kept
+        q = tfrc.LineQueue(3, 'keep-latest')
+        lines = [self.line('65b0', 'a'), self.line('1234', 'b'),
+                 self.line('65b0', 'c'), self.line('65b0', 'd')]
+        q.put(lines)
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual(q.dropped, 1)
+        self.assertEqual(q.get(block=False), lines[1:])
+        self.assertTrue(q.empty())
+
+    def test_keep_latest_other_sensor(self):
+        # a line from a sensor that has nothing queued drops the oldest line
+        q = tfrc.LineQueue(2, 'keep-latest')
+        lines = [self.line('65b0', 'a'), self.line('1234', 'b'),
+                 self.line('abcd', 'c'), 'no sensor']
+        q.put(lines)
+        self.assertEqual(q.dropped, 2)
+        self.assertEqual(q.get(block=False), lines[2:])
+
+    def test_drop_oldest(self):
+        q = tfrc.LineQueue(2)
+        q.put(['a', 'b', 'c'])
+        self.assertEqual(q.dropped, 1)
+        self.assertEqual(q.get(block=False), ['b', 'c'])
+
+    def test_block(self):
+        # the producer waits until the queue has been read
+        q = tfrc.LineQueue(2, 'block')
+        q.put(['a', 'b'])
+        t = threading.Thread(target=q.put, args=(['c'],))
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive())
+        self.assertEqual(q.get(block=False), ['a', 'b'])
+        t.join(1)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(q.get(block=False), ['c'])
+        self.assertEqual(q.dropped, 0)
+
+    def test_producers(self):
+        # the queue ends only once every producer has ended
+        q = tfrc.LineQueue()
+        q.add_producer()
+        q.add_producer()
+        q.put(['a'])
+        q.put(None)
+        self.assertEqual(q.get(), ['a'])
+        self.assertRaises(tfrc.queue.Empty, q.get, timeout=0.05)
+        q.put(None)
+        self.assertIsNone(q.get())
+
+    def test_get_sensor(self):
+        self.assertEqual(tfrc.LineQueue.get_sensor(TFA_1_LINE % 'e'), '65b0')
+        self.assertEqual(tfrc.LineQueue.get_sensor(WEATHERHUB_LINE % '0'),
+                         '0b3d9dde00000')
+        self.assertIsNone(tfrc.LineQueue.get_sensor('#001 1485215350 2d'))
+
+
+class ReceiverMergerTest(unittest.TestCase):
+
+    @staticmethod
+    def reading(sensor, ts, seq, rssi):
+        return tfrc.Reading('TFA_1Packet', sensor, ts,
+                            {'sequence': seq, 'rssi': rssi})
+
+    def test_best_rssi(self):
+        # the same telegram from two receivers is released once, with the
+        # best rssi, after the window
+        m = tfrc.ReceiverMerger(window=1.0)
+        weak = self.reading('65B0', 100, 14, 60)
+        strong = self.reading('65B0', 100, 14, 80)
+        self.assertEqual(m.merge([weak], now=1000.0, line='weak'), [])
+        self.assertEqual(m.merge([strong], now=1000.5, line='strong'), [])
+        self.assertEqual(m.merge([], now=1001.0), [(strong, 'strong')])
+        self.assertEqual(m.merged, 1)
+
+    def test_weaker_duplicate(self):
+        m = tfrc.ReceiverMerger(window=1.0)
+        strong = self.reading('65B0', 100, 14, 80)
+        m.merge([strong], now=1000.0, line='strong')
+        m.merge([self.reading('65B0', 100, 14, 60)], now=1000.1, line='weak')
+        self.assertEqual(m.flush(), [(strong, 'strong')])
+        self.assertEqual(m.flush(), [])
+
+    def test_order(self):
+        # different telegrams are all kept, and released by timestamp
+        m = tfrc.ReceiverMerger(window=1.0)
+        late = self.reading('65B0', 102, 15, 80)
+        early = self.reading('1234', 101, 3, 70)
+        m.merge([late], now=1000.0, line='late')
+        m.merge([early], now=1000.2, line='early')
+        self.assertEqual(m.merge([], now=1002.0),
+                         [(early, 'early'), (late, 'late')])
+        self.assertEqual(m.merged, 0)
+
+
+class PacketCoalescerTest(unittest.TestCase):
+
+    def test_merge(self):
+        # packets within the window are merged, with the latest timestamp
+        c = tfrc.PacketCoalescer(window=10)
+        self.assertEqual(c.add({'dateTime': 102, 'usUnits': 16,
+                                'outTemp': 21.0}, now=1000), [])
+        self.assertEqual(c.add({'dateTime': 101, 'usUnits': 16,
+                                'outHumidity': 40}, now=1005), [])
+        self.assertEqual(c.flush(), {'dateTime': 102, 'usUnits': 16,
+                                     'outTemp': 21.0, 'outHumidity': 40})
+        self.assertEqual(c.merged, 1)
+        self.assertIsNone(c.flush())
+
+    def test_overwrite(self):
+        # a field that is already in the merged packet releases it early
+        c = tfrc.PacketCoalescer(window=10)
+        first = {'dateTime': 100, 'usUnits': 16, 'outTemp': 21.0}
+        c.add(first, now=1000)
+        second = {'dateTime': 101, 'usUnits': 16, 'outTemp': 21.5}
+        self.assertEqual(c.add(second, now=1001), [first])
+        self.assertEqual(c.flush(), second)
+
+    def test_units(self):
+        c = tfrc.PacketCoalescer(window=10)
+        first = {'dateTime': 100, 'usUnits': 16, 'outTemp': 21.0}
+        c.add(first, now=1000)
+        self.assertEqual(c.add({'dateTime': 101, 'usUnits': 1,
+                                'outHumidity': 40}, now=1001), [first])
+
+    def test_window(self):
+        c = tfrc.PacketCoalescer(window=10)
+        first = {'dateTime': 100, 'usUnits': 16, 'outTemp': 21.0}
+        c.add(first, now=1000)
+        self.assertEqual(c.add({'dateTime': 110, 'usUnits': 16,
+                                'outHumidity': 40}, now=1010), [first])
+        self.assertEqual(c.merged, 0)
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'ring')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def fields(n):
+        return ('65B0 +21.0 40 %d 0 80 %d' % (n % 16, 1700000000 + n)).split()
+
+    def test_read(self):
+        writer = tfrc.RingBuffer(self.filename, capacity=4, writer=True)
+        reader = tfrc.RingBuffer(self.filename)
+        self.assertFalse(writer.append(['65B0', '+21.0']))
+        for n in range(3):
+            self.assertTrue(writer.append(self.fields(n)))
+        lines, pos, lost = reader.read(0)
+        self.assertEqual(lines, [' '.join(self.fields(n)) for n in range(3)])
+        self.assertEqual((pos, lost), (3, 0))
+        self.assertEqual(reader.read(pos), ([], 3, 0))
+        reader.close()
+        writer.close()
+
+    def test_wrap(self):
+        # a reader that falls a ring behind loses the overwritten records,
+        # and the slot that the writer fills next
+        writer = tfrc.RingBuffer(self.filename, capacity=4, writer=True)
+        reader = tfrc.RingBuffer(self.filename)
+        for n in range(6):
+            writer.append(self.fields(n))
+        self.assertEqual(reader.written, 6)
+        lines, pos, lost = reader.read(0)
+        self.assertEqual((pos, lost), (6, 3))
+        self.assertEqual([l.split()[-1] for l in lines],
+                         ['1700000003', '1700000004', '1700000005'])
+        lines, pos, lost = reader.read(4)
+        self.assertEqual((len(lines), pos, lost), (2, 6, 0))
+        reader.close()
+        writer.close()
+
+    def test_reopen(self):
+        # a writer continues a ring of the same capacity, and replaces one of
+        # another capacity
+        writer = tfrc.RingBuffer(self.filename, capacity=4, writer=True)
+        writer.append(self.fields(0))
+        writer.close()
+        writer = tfrc.RingBuffer(self.filename, capacity=4, writer=True)
+        self.assertEqual(writer.written, 1)
+        writer.close()
+        writer = tfrc.RingBuffer(self.filename, capacity=8, writer=True)
+        self.assertEqual(writer.written, 0)
+        writer.close()
+
+    def test_not_a_ring(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'x' * 64)
+        self.assertRaises(weewx.WeeWxIOError, tfrc.RingBuffer, self.filename)
+
+
+class SuperviseTest(unittest.TestCase):
+
+    def restart(self, manager, receiver):
+        # wait for the process to exit, and return the delay before the next
+        # restart, or None if the manager gave up
+        receiver.process.wait()
+        now = time.time()
+        if not manager.supervise():
+            return None
+        delay = receiver.restart_at - now
+        receiver.restart_at = 0
+        manager.supervise()
+        return round(delay)
+
+    def test_backoff(self):
+        # the delay doubles with each restart without output, until the
+        # manager gives up after max_restarts of them
+        manager = tfrc.ProcManager(max_restarts=3)
+        manager.startup('true')
+        try:
+            receiver = manager._receivers[0]
+            delays = [self.restart(manager, receiver) for _ in range(4)]
+            self.assertEqual(delays, [2, 4, 8, None])
+            self.assertEqual(receiver.restarts, 3)
+        finally:
+            manager.shutdown()
+
+    def test_output_resets_backoff(self):
+        manager = tfrc.ProcManager(max_restarts=1)
+        manager.startup('echo hello')
+        try:
+            receiver = manager._receivers[0]
+            delays = [self.restart(manager, receiver) for _ in range(3)]
+            self.assertEqual(delays, [2, 2, 2])
+            self.assertEqual(receiver.failures, 1)
+        finally:
+            manager.shutdown()
+
+
+class SubtypeTest(unittest.TestCase):
+
+    def tearDown(self):
+        tfrc.PacketFactory.configure()
+
+    def test_decode(self):
+        # the last character of the identifier selects the observations of
+        # the temperature and humidity values
+        decode = tfrc.Packet.decode
+        self.assertEqual(decode(tfrc.TX22Packet, '30009903', 2.5, 270),
+                         {'hardware_id': '3000990', 'wind_speed': 9.0,
+                          'wind_dir': 270})
+        self.assertEqual(decode(tfrc.TFA_2Packet, '10009901', 17.2, 0),
+                         {'hardware_id': '1000990', 'temperature_ext': 17.2})
+        self.assertEqual(decode(tfrc.TX22Packet, '30009900', 17.2, 0),
+                         {'hardware_id': '3000990', 'temperature': 17.2})
+        self.assertIsNone(decode(tfrc.TX22Packet, '30009905', 1, 0))
+        self.assertEqual(decode(tfrc.TFA_1Packet, '65b0', 22.0, 35),
+                         {'hardware_id': '65b0', 'temperature': 22.0,
+                          'humidity': 35})
+
+    def test_burst(self):
+        # the lines of one WeatherHub transmission make one packet
+        tfrc.PacketFactory.configure(tfrc.WeatherHubPacket.TYPE_MASK)
+        lines = deque([WEATHERHUB_LINE % '2', WEATHERHUB_LINE % '3'])
+        pkts = list(tfrc.PacketFactory.create(lines))
+        self.assertEqual(len(pkts), 1)
+        self.assertEqual(pkts[0].sensor_id, '0B3D9DDE0000')
+        self.assertEqual(pkts[0].timestamp, 1485215351)
+        values = pkts[0].values
+        self.assertEqual(values['rain_count'], 12.8)
+        self.assertAlmostEqual(values['rain_total'], 0.32)
+        self.assertEqual(values['rain_age'], 28)
+        self.assertAlmostEqual(values['wind_speed'], 46.08)
+        self.assertEqual(values['wind_dir'], 28)
+
+
+class AutoTunerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'tune.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_window(self, tuner, count, offset=None):
+        # receive count telegrams in the window of the current command, and
+        # return the command to run next
+        start = self.now
+        self.now += 100
+        for i in range(count):
+            values = {'offset': offset} if offset is not None else {}
+            tuner.add(tfrc.Reading('TFA_1Packet', '65B0', i, values),
+                      now=start + 50)
+        return tuner.check(now=self.now)
+
+    def test_stages(self):
+        # the best gain is kept for the trigger levels, and the frequency is
+        # corrected by the offset with the best options
+        tuner = tfrc.AutoTuner('tfrec -q', gains=[20, 40], triggers=[500],
+                               window=100, filename=self.filename)
+        self.now = time.time()
+        self.assertIsNone(tuner.check(now=self.now + 50))
+        self.assertEqual(self.run_window(tuner, 9), 'tfrec -g 20 -q')
+        self.assertEqual(self.run_window(tuner, 18, 10), 'tfrec -g 40 -q')
+        self.assertEqual(self.run_window(tuner, 9), 'tfrec -t 500 -g 20 -q')
+        self.assertEqual(self.run_window(tuner, 9),
+                         'tfrec -f 868240000 -g 20 -q')
+        self.assertEqual(self.run_window(tuner, 9),
+                         'tfrec -f 868245000 -g 20 -q')
+        self.assertFalse(tuner.done)
+        self.assertEqual(self.run_window(tuner, 9), 'tfrec -g 20 -q')
+        self.assertTrue(tuner.done)
+        self.assertEqual(tuner.best, (12.0, 'tfrec -g 20 -q', 10))
+        self.assertIsNone(self.run_window(tuner, 30))
+        self.assertEqual(tfrc.AutoTuner.load(self.filename, 'tfrec -q'),
+                         'tfrec -g 20 -q')
+        self.assertIsNone(tfrc.AutoTuner.load(self.filename, 'tfrec'))
+
+    def test_options(self):
+        tuner = tfrc.AutoTuner
+        self.assertEqual(tuner.set_option('tfrec -g 20 -q', '-g', 40),
+                         'tfrec -g 40 -q')
+        self.assertEqual(tuner.set_option('tfrec -q', '-t', 500),
+                         'tfrec -t 500 -q')
+        self.assertEqual(tuner.get_option('tfrec -q -f', '-f'), None)
+        self.assertEqual(tuner.get_frequencies('tfrec -f 868250', 10),
+                         [868240, 868245])
+        self.assertEqual(tuner.get_frequencies('tfrec', -10),
+                         [868260000, 868255000])
+        self.assertEqual(tuner.get_frequencies('tfrec', 2), [])
+        self.assertEqual(tuner.get_frequencies('tfrec', None), [])
+
+
+class DutyCycleTest(unittest.TestCase):
+
+    def test_next_window(self):
+        # each window ends MARGIN seconds before an interval boundary, and
+        # only a window that can be listened to in full is chosen
+        dc = tfrc.DutyCycleManager(window=60, interval=300)
+        self.assertEqual(dc.next_window(1000), 1135)
+        self.assertEqual(dc.next_window(1135), 1135)
+        self.assertEqual(dc.next_window(1136), 1435)
+        self.assertEqual(dc.next_window(1200), 1435)
+        self.assertEqual((dc.next_window(1000) + 60 +
+                          tfrc.DutyCycleManager.MARGIN) % 300, 0)
+
+    def test_window_cmd(self):
+        self.assertEqual(
+            tfrc.DutyCycleManager.get_window_cmd('tfrec -D -q', 60),
+            'tfrec -w 60 -m 1 -D -q')
+
+
+class ServiceTest(unittest.TestCase):
+
+    class Engine(object):
+        def __init__(self):
+            self.callbacks = dict()
+
+        def bind(self, event_type, callback):
+            self.callbacks[event_type] = callback
+
+    class Event(object):
+        def __init__(self, packet):
+            self.packet = packet
+
+    def setUp(self):
+        # a temperature, and a rain counter that goes up by 4 counts of
+        # 0.025 cm twice
+        self.tmpdir = tempfile.mkdtemp()
+        self.replay = os.path.join(self.tmpdir, 'tfrec.txt')
+        with open(self.replay, 'w') as f:
+            f.write(TFA_1_LINE % 'e' + '\n')
+            for i, count in enumerate([10, 14, 18]):
+                ts = 1485215360 + i * 10
+                f.write(RAIN_LINE % (ts, count, i, ts) + '\n')
+        self.engine = ServiceTest.Engine()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def start(self, max_age):
+        config_dict = {'TFRC': {
+            'cmd': 'tfrec -D -T 21', 'replay_file': self.replay,
+            'max_age': str(max_age),
+            'sensor_map': {
+                'outTemp': 'temperature.65B0.TFA_1Packet',
+                'rain_total': 'rain_total.0B3D9DDE0000.WeatherHubPacket'}}}
+        self.service = tfrc.TFRCService(self.engine, config_dict)
+        self.addCleanup(self.service.shutDown)
+        deadline = time.time() + 10
+        while len(self.service._cache) < 3 and time.time() < deadline:
+            time.sleep(0.05)
+
+    def loop_packet(self, **packet):
+        packet.setdefault('dateTime', int(time.time()))
+        packet.setdefault('usUnits', weewx.METRIC)
+        self.engine.callbacks[weewx.NEW_LOOP_PACKET](
+            ServiceTest.Event(packet))
+        return packet
+
+    def test_fields(self):
+        # the fields are converted to the units of the loop packet, and the
+        # deltas are added up until a loop packet takes them
+        self.start(max_age=10 ** 10)
+        pkt = self.loop_packet(usUnits=weewx.US)
+        self.assertAlmostEqual(pkt['outTemp'], 71.6)
+        self.assertAlmostEqual(pkt['rain'], 0.2 / 2.54)
+        pkt = self.loop_packet(outTemp=20.0)
+        self.assertEqual(pkt['outTemp'], 20.0)
+        self.assertAlmostEqual(pkt['rain_total'], 0.45)
+        self.assertNotIn('rain', pkt)
+
+    def test_max_age(self):
+        # old values are left out, but not the deltas
+        self.start(max_age=300)
+        pkt = self.loop_packet(rain=0.0)
+        self.assertEqual(pkt['rain'], 0.0)
+        self.assertNotIn('outTemp', pkt)
+        self.assertNotIn('rain', self.loop_packet())
+
+
+if __name__ == '__main__':
+    unittest.main()